@@ -0,0 +1,88 @@
+"""
+Стандартная AiohttpSession против bot_session.BotSession на локальном фейковом Bot API.
+
+Фейковый Bot API (bench.fake_bot_api, лимиты выключены) отвечает на sendMessage
+с заданной задержкой (имитация RTT до Telegram).
+Отправляется несколько пачек по --burst сообщений с --concurrency параллельных
+запросов и паузой --pause между ними: при паузе дольше keep-alive стандартной
+сессии (15 с) каждая пачка заново открывает соединения.
+Сервер без TLS, поэтому стоимость нового соединения здесь занижена.
+
+Запуск из каталога server:
+    python -m bench.bot_session_bench --burst 300 --concurrency 30 --latency-ms 50 --bursts 3 --pause 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from bench.fake_bot_api import FakeBotApi, start_fake_bot_api
+from bot_session import BOT_HTTP_CONNECTIONS_OPENED, BOT_HTTP_POOL_WAIT, BotSession
+
+TOKEN = "123456:bench"
+
+
+async def run_bursts(bot: Bot, args) -> list[float]:
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(chat_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await bot.send_message(chat_id=chat_id, text="<b>Событие завершено</b>", parse_mode="HTML")
+            latencies.append(time.perf_counter() - started)
+
+    for i in range(args.bursts):
+        if i:
+            await asyncio.sleep(args.pause)
+        await asyncio.gather(*(one(1000 + n) for n in range(args.burst)))
+    return latencies
+
+
+async def measure(name: str, session, base_url: str, api: FakeBotApi, args):
+    api.reset()
+    session.api = TelegramAPIServer.from_base(base_url)
+    bot = Bot(token=TOKEN, session=session)
+    started = time.perf_counter()
+    try:
+        latencies = await run_bursts(bot, args)
+    finally:
+        await session.close()
+    elapsed = time.perf_counter() - started - args.pause * (args.bursts - 1)
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(f"{name:<10}{len(latencies) / elapsed:>10.0f}{statistics.median(latencies) * 1000:>10.1f}"
+          f"{p99 * 1000:>10.1f}{len(api._transports):>8}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--burst", type=int, default=300)
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--pause", type=float, default=20)
+    parser.add_argument("--pool-per-host", type=int, default=50)
+    args = parser.parse_args()
+
+    api = FakeBotApi(global_rate=0, chat_rate=0, latency_ms=args.latency_ms)
+    runner, base_url = await start_fake_bot_api(api)
+
+    print(f"{'session':<10}{'msg/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'conns':>8}")
+    try:
+        await measure("default", AiohttpSession(), base_url, api, args)
+        await measure("tuned", BotSession(pool_per_host=args.pool_per_host), base_url, api, args)
+    finally:
+        await runner.cleanup()
+
+    print(f"tuned: connections new={BOT_HTTP_CONNECTIONS_OPENED.value('new'):.0f} "
+          f"reused={BOT_HTTP_CONNECTIONS_OPENED.value('reused'):.0f}, "
+          f"pool waits={sum(state[2] for state in BOT_HTTP_POOL_WAIT._values.values())}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,136 @@
+"""
+Сравнение CPU на запрос: стандартный JSONResponse + jsonable_encoder + json.loads/Model(**data)
+против codec.json_response (orjson / model_dump_json) + model_validate_json.
+
+Запуск из каталога server:
+    python -m bench.codec_bench --events 300 --slots 40 --voters 25 --requests 300
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from codec import DefaultResponse, json_response, read_model
+from models import ActiveEventResponse, EventCreate, EventFullResponse
+from uuid6 import uuid7
+
+
+def make_list_payload(n_events: int) -> list[dict]:
+    now = datetime.now()
+    return [
+        dict(ActiveEventResponse(
+            id=i, public_id=uuid7(), title=f"Event {i}", event_type="poll",
+            participant_count=i % 50, final_slot_id=None, is_creator=bool(i % 2),
+        ))
+        | {"created_at": now}
+        for i in range(n_events)
+    ]
+
+
+def make_detail_payload(n_slots: int, n_voters: int) -> EventFullResponse:
+    now = datetime.now(timezone.utc)
+    voters = [
+        {"telegram_user_id": 100000 + v, "username": f"user{v}", "first_name": "Имя", "last_name": "Фамилия",
+         "photo_url": f"https://t.me/i/userpic/320/{v}.jpg", "voted_at": now.isoformat()}
+        for v in range(n_voters)
+    ]
+    data = {
+        "event": {
+            "id": 1, "public_id": str(uuid7()), "title": "Встреча", "description": "Описание", "location": None,
+            "timezone": "Europe/Moscow", "event_type": "poll", "multiple_choice": True,
+            "created_at": now.isoformat(), "updated_at": None, "deleted_at": None, "user_id": 1,
+            "final_slot_id": None, "is_creator": True,
+            "creator": {"telegram_user_id": 1, "username": "creator", "first_name": "A", "last_name": "B",
+                        "photo_url": None},
+        },
+        "slots": [
+            {"id": s, "slot_start": (now + timedelta(minutes=15 * s)).isoformat(), "created_at": now.isoformat(),
+             "current_user_voted": False, "vote_count": n_voters, "voters": voters}
+            for s in range(n_slots)
+        ],
+        "participants": voters,
+        "current_user_votes": [],
+    }
+    return EventFullResponse.model_validate(data)
+
+
+def make_create_body(n_dates: int, n_times: int) -> bytes:
+    return json.dumps({
+        "title": "Бенчмарк", "description": "x", "timezone": "Europe/Moscow", "eventType": "poll",
+        "allowMultipleChoice": True,
+        "dates": [
+            {"date": f"2030-01-{d + 1:02d}T00:00:00", "timeSlots": [f"{h // 4:02d}:{h % 4 * 15:02d}" for h in range(n_times)]}
+            for d in range(n_dates)
+        ],
+    }).encode()
+
+
+def build_app(fast: bool, list_payload, detail_payload) -> FastAPI:
+    app = FastAPI(default_response_class=DefaultResponse if fast else JSONResponse)
+
+    @app.get("/api/events/active")
+    async def active():
+        return json_response(list_payload) if fast else list_payload
+
+    @app.get("/api/events/{event_id}")
+    async def detail(event_id: int):
+        return json_response(detail_payload) if fast else detail_payload
+
+    @app.post("/api/events/create")
+    async def create(request: Request):
+        if fast:
+            event = await read_model(request, EventCreate)
+        else:
+            event = EventCreate(**json.loads(await request.body()))
+        return {"ok": True, "dates": len(event.dates)}
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, method: str, url: str, n: int, body: bytes | None = None) -> float:
+    # прогрев
+    await client.request(method, url, content=body)
+    start = time.process_time()
+    for _ in range(n):
+        response = await client.request(method, url, content=body)
+        response.raise_for_status()
+    return (time.process_time() - start) / n * 1000
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=300)
+    parser.add_argument("--slots", type=int, default=40)
+    parser.add_argument("--voters", type=int, default=25)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    list_payload = make_list_payload(args.events)
+    detail_payload = make_detail_payload(args.slots, args.voters)
+    create_body = make_create_body(14, 40)
+
+    cases = [
+        ("GET", "/api/events/active", None),
+        ("GET", "/api/events/1", None),
+        ("POST", "/api/events/create", create_body),
+    ]
+    results = {}
+    for fast in (False, True):
+        app = build_app(fast, list_payload, detail_payload)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            for method, url, body in cases:
+                results[(method, url, fast)] = await measure(client, method, url, args.requests, body)
+
+    print(f"{'endpoint':<32}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for method, url, _ in cases:
+        before, after = results[(method, url, False)], results[(method, url, True)]
+        print(f"{method + ' ' + url:<32}{before:>12.3f}{after:>12.3f}{before / after:>9.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,286 @@
+"""
+Генератор синтетических данных большого объёма через COPY (copy_records_to_table).
+
+В отличие от db.fill_test_data строит реалистичные распределения:
+- число событий и голосов по пользователям — степенное (немногие очень активны);
+- популярность событий — Парето, голоса по слотам пропорциональны популярности;
+- часть событий удалена (soft delete), часть финализирована, часть финализирована в прошлом (истекла);
+- часть слотов и голосов помечена deleted_at.
+
+Всё детерминировано от --seed. Пользователи, события и слоты пишутся с явными id,
+голоса генерируются параллельно в --workers процессах по диапазонам событий.
+
+Запуск из каталога server (ОЧИЩАЕТ таблицы):
+    python -m bench.datagen --db-url postgresql://... --truncate \\
+        --users 1000000 --events-per-user 1 --slots-per-event 10 --votes-per-slot 5 --workers 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import random
+import time
+from array import array
+from datetime import datetime, timedelta, timezone
+from uuid import UUID
+
+import asyncpg
+
+from db import create_tables
+
+COPY_BATCH = 50_000
+FIRST_TELEGRAM_ID = 1_000_000_000
+TIMEZONES = ("Europe/Moscow", "Europe/Berlin", "UTC", "America/New_York", "Asia/Almaty")
+LANGUAGES = ("ru", "ru", "ru", "en", "en", "uk", "de")
+
+USER_COLUMNS = ("id", "telegram_user_id", "username", "first_name", "last_name", "language_code",
+                "is_premium", "allows_write_to_pm", "photo_url", "created_at")
+EVENT_COLUMNS = ("id", "public_id", "user_id", "title", "description", "timezone", "event_type",
+                 "multiple_choice", "created_at", "updated_at", "deleted_at", "location")
+SLOT_COLUMNS = ("id", "event_id", "slot_start", "created_at", "deleted_at")
+VOTE_COLUMNS = ("event_id", "slot_id", "user_id", "created_at", "deleted_at")
+
+# Флаги события в плане
+DELETED, FINALIZED, EXPIRED = 1, 2, 4
+
+# План генерации: заполняется в родительском процессе и наследуется воркерами через fork
+PLAN: dict = {}
+
+
+def _skewed_index(rng: random.Random, n: int, skew: float) -> int:
+    """0..n-1, малые индексы встречаются сильно чаще (степенное распределение)"""
+    return min(n - 1, int(n * rng.random() ** skew))
+
+
+def _slot_deleted(slot_id: int, ratio: float) -> bool:
+    # детерминированный хеш: воркер голосов знает про удалённые слоты без общего состояния
+    return (slot_id * 2654435761) % 10_000 < ratio * 10_000
+
+
+def build_plan(args) -> dict:
+    rng = random.Random(args.seed)
+    n_events = max(1, round(args.users * args.events_per_user))
+    creators = array("i", bytes(4 * n_events))
+    n_slots = array("i", bytes(4 * n_events))
+    first_slot = array("q", bytes(8 * n_events))
+    weights = array("d", bytes(8 * n_events))
+    flags = array("b", bytes(n_events))
+    day_offset = array("i", bytes(4 * n_events))
+
+    # среднее Pareto(alpha) = alpha / (alpha - 1): нормируем, чтобы средний вес был 1
+    alpha = args.popularity_alpha
+    pareto_mean = alpha / (alpha - 1)
+    next_slot = 1
+    for i in range(n_events):
+        creators[i] = 1 + _skewed_index(rng, args.users, args.activity_skew)
+        slots = max(1, min(4 * args.slots_per_event, round(rng.gauss(args.slots_per_event, args.slots_per_event / 3))))
+        n_slots[i] = slots
+        first_slot[i] = next_slot
+        next_slot += slots
+        weights[i] = rng.paretovariate(alpha) / pareto_mean
+
+        flag = 0
+        if rng.random() < args.deleted_ratio:
+            flag |= DELETED
+        if rng.random() < args.finalized_ratio:
+            flag |= FINALIZED
+            if rng.random() < args.expired_ratio:
+                flag |= EXPIRED
+        flags[i] = flag
+        # истёкшие события — в прошлом, остальные — в ближайшие два месяца
+        day_offset[i] = -rng.randint(2, 365) if flag & EXPIRED else rng.randint(1, 60)
+
+    return {
+        "n_events": n_events, "n_slots_total": next_slot - 1, "creators": creators, "n_slots": n_slots,
+        "first_slot": first_slot, "weights": weights, "flags": flags, "day_offset": day_offset,
+        "now": datetime.now(timezone.utc).replace(microsecond=0, second=0, minute=0),
+    }
+
+
+def user_records(args, start: int, stop: int):
+    rng = random.Random(args.seed * 7 + start)
+    now = PLAN["now"].replace(tzinfo=None)
+    for uid in range(start, stop):
+        yield (
+            uid, FIRST_TELEGRAM_ID + uid, f"user{uid}", f"Имя{uid % 997}", f"Фамилия{uid % 991}",
+            LANGUAGES[uid % len(LANGUAGES)], rng.random() < 0.1, rng.random() > args.blocked_ratio,
+            f"https://t.me/i/userpic/320/{uid}.jpg" if uid % 3 else None,
+            now - timedelta(minutes=rng.randint(0, 525_600)),
+        )
+
+
+def event_records(args, start: int, stop: int):
+    rng = random.Random(args.seed * 11 + start)
+    now = PLAN["now"].replace(tzinfo=None)
+    for i in range(start, stop):
+        flag = PLAN["flags"][i]
+        created = now + timedelta(days=min(PLAN["day_offset"][i], 0) - rng.randint(1, 30))
+        yield (
+            i + 1, UUID(int=rng.getrandbits(128), version=4), PLAN["creators"][i], f"Событие #{i + 1}",
+            "Сгенерировано bench.datagen" if i % 2 else None, TIMEZONES[i % len(TIMEZONES)],
+            "booking" if i % 5 == 0 else "poll", i % 3 == 0, created,
+            created + timedelta(hours=1) if flag & FINALIZED else None,
+            created + timedelta(days=1) if flag & DELETED else None,
+            "Zoom" if i % 4 == 0 else None,
+        )
+
+
+def slot_records(args, start: int, stop: int):
+    for i in range(start, stop):
+        base = PLAN["now"] + timedelta(days=PLAN["day_offset"][i], hours=9 - PLAN["now"].hour)
+        created = PLAN["now"].replace(tzinfo=None) - timedelta(days=1)
+        first = PLAN["first_slot"][i]
+        for k in range(PLAN["n_slots"][i]):
+            slot_id = first + k
+            deleted = created if _slot_deleted(slot_id, args.deleted_slot_ratio) else None
+            yield slot_id, i + 1, base + timedelta(minutes=30 * k), created, deleted
+
+
+def vote_records(args, start: int, stop: int):
+    rng = random.Random(args.seed * 13 + start)
+    users = args.users
+    for i in range(start, stop):
+        event_id = i + 1
+        lam = args.votes_per_slot * PLAN["weights"][i]
+        base = PLAN["now"].replace(tzinfo=None) + timedelta(days=min(PLAN["day_offset"][i], 0) - 1)
+        vote_times = [base - timedelta(minutes=m * 7) for m in range(16)]
+        first = PLAN["first_slot"][i]
+        for k in range(PLAN["n_slots"][i]):
+            slot_id = first + k
+            if _slot_deleted(slot_id, args.deleted_slot_ratio):
+                continue
+            count = int(lam) + (rng.random() < lam - int(lam))
+            count = min(count, users, args.max_votes_per_slot)
+            seen = set()
+            for n in range(count):
+                voter = 1 + _skewed_index(rng, users, args.activity_skew)
+                if voter in seen:
+                    continue
+                seen.add(voter)
+                deleted = vote_times[0] if rng.random() < args.deleted_vote_ratio else None
+                yield event_id, slot_id, voter, vote_times[n & 15], deleted
+
+
+def _batched(records, size: int = COPY_BATCH):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def _copy_range(db_url: str, table: str, columns, records) -> int:
+    conn = await asyncpg.connect(db_url)
+    total = 0
+    try:
+        for batch in _batched(records):
+            await conn.copy_records_to_table(table, records=batch, columns=columns)
+            total += len(batch)
+    finally:
+        await conn.close()
+    return total
+
+
+GENERATORS = {
+    "users": (USER_COLUMNS, user_records),
+    "events": (EVENT_COLUMNS, event_records),
+    "event_slots": (SLOT_COLUMNS, slot_records),
+    "event_votes": (VOTE_COLUMNS, vote_records),
+}
+
+
+def _worker(job) -> int:
+    args, table, start, stop = job
+    columns, generator = GENERATORS[table]
+    return asyncio.run(_copy_range(args.db_url, table, columns, generator(args, start, stop)))
+
+
+def copy_parallel(pool, args, table: str, start: int, stop: int) -> int:
+    # мелкие диапазоны, чтобы воркеры выравнивались по нагрузке при степенных распределениях
+    step = max(1, (stop - start) // (args.workers * 8))
+    jobs = [(args, table, s, min(stop, s + step)) for s in range(start, stop, step)]
+    started = time.perf_counter()
+    total = sum(pool.imap_unordered(_worker, jobs))
+    print(f"{table}: {total:,} rows in {time.perf_counter() - started:.1f}s")
+    return total
+
+
+async def prepare(args):
+    conn = await asyncpg.connect(args.db_url)
+    try:
+        await create_tables(conn)
+        if args.truncate:
+            await conn.execute("TRUNCATE TABLE event_votes, event_slots, events, users RESTART IDENTITY CASCADE")
+        elif await conn.fetchval("SELECT EXISTS (SELECT 1 FROM users)"):
+            raise SystemExit("Tables are not empty; pass --truncate to wipe them")
+    finally:
+        await conn.close()
+
+
+async def finish(args):
+    conn = await asyncpg.connect(args.db_url)
+    try:
+        # финальные слоты: circular FK events <-> event_slots, поэтому проставляем одним UPDATE после COPY
+        await conn.execute("CREATE TEMP TABLE datagen_final_slots (event_id INTEGER, slot_id INTEGER)")
+        final_rows = (
+            (i + 1, PLAN["first_slot"][i])
+            for i in range(PLAN["n_events"]) if PLAN["flags"][i] & FINALIZED
+        )
+        for batch in _batched(final_rows):
+            await conn.copy_records_to_table("datagen_final_slots", records=batch)
+        await conn.execute("""
+            UPDATE events e SET final_slot_id = f.slot_id
+            FROM datagen_final_slots f
+            WHERE e.id = f.event_id
+        """)
+        for table in ("users", "events", "event_slots"):
+            await conn.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                               f"COALESCE((SELECT MAX(id) FROM {table}), 1))")
+        await conn.execute("ANALYZE users, events, event_slots, event_votes")
+    finally:
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", required=True)
+    parser.add_argument("--truncate", action="store_true", help="очистить таблицы перед генерацией")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--events-per-user", type=float, default=1.0, help="в среднем на пользователя")
+    parser.add_argument("--slots-per-event", type=int, default=10)
+    parser.add_argument("--votes-per-slot", type=float, default=5.0, help="в среднем на слот")
+    parser.add_argument("--max-votes-per-slot", type=int, default=5_000)
+    parser.add_argument("--activity-skew", type=float, default=3.0,
+                        help="степень перекоса активности пользователей (1 — равномерно)")
+    parser.add_argument("--popularity-alpha", type=float, default=1.5, help="параметр Парето популярности событий")
+    parser.add_argument("--deleted-ratio", type=float, default=0.05)
+    parser.add_argument("--finalized-ratio", type=float, default=0.3)
+    parser.add_argument("--expired-ratio", type=float, default=0.5, help="доля финализированных в прошлом")
+    parser.add_argument("--deleted-slot-ratio", type=float, default=0.02)
+    parser.add_argument("--deleted-vote-ratio", type=float, default=0.05)
+    parser.add_argument("--blocked-ratio", type=float, default=0.02, help="доля пользователей без allows_write_to_pm")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    asyncio.run(prepare(args))
+    PLAN.update(build_plan(args))
+    print(f"plan: {PLAN['n_events']:,} events, {PLAN['n_slots_total']:,} slots "
+          f"(~{PLAN['n_slots_total'] * args.votes_per_slot:,.0f} votes) in {time.perf_counter() - started:.1f}s")
+
+    # fork: воркеры наследуют PLAN без сериализации
+    with multiprocessing.get_context("fork").Pool(args.workers) as pool:
+        copy_parallel(pool, args, "users", 1, args.users + 1)
+        copy_parallel(pool, args, "events", 0, PLAN["n_events"])
+        copy_parallel(pool, args, "event_slots", 0, PLAN["n_events"])
+        copy_parallel(pool, args, "event_votes", 0, PLAN["n_events"])
+
+    asyncio.run(finish(args))
+    print(f"done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
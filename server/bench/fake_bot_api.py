@@ -0,0 +1,159 @@
+"""
+Локальный заменитель Telegram Bot API для нагрузочных тестов уведомлений.
+
+Отвечает на любые методы бота (sendMessage — с сохранением сообщения, остальные — ok/true),
+эмулирует лимиты Telegram ответом 429 с retry_after:
+- общий: не больше --global-rate сообщений за скользящую секунду;
+- на чат: не чаще --chat-rate сообщений в секунду в один chat_id;
+добавляет задержку ответа (--latency-ms ± --jitter-ms).
+
+Служебные эндпоинты (без токена):
+    GET  /counters            — счётчики запросов, отправленных сообщений и 429
+    GET  /messages?chat_id=N  — записанные сообщения (последние --keep)
+    POST /reset               — обнулить счётчики и журнал
+
+Отдельный процесс (сервер указывается боту через BOT_API_URL):
+    python -m bench.fake_bot_api --port 8081 --latency-ms 50
+    BOT_API_URL=http://127.0.0.1:8081 uvicorn main:app
+Внутри бенчмарка — через start_fake_bot_api().
+"""
+import argparse
+import asyncio
+import math
+import random
+import time
+from collections import Counter, deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from aiohttp import web
+
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_CHAT_RATE = 1
+
+
+class FakeBotApi:
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 latency_ms: float = 0, jitter_ms: float = 0, keep: int = 100_000):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.keep = keep
+        self.reset()
+
+    def reset(self) -> None:
+        self.counters: Counter = Counter()
+        self.methods: Counter = Counter()
+        self.messages: Deque[Dict[str, Any]] = deque(maxlen=self.keep)
+        self._window: Deque[float] = deque()       # время принятых сообщений за последнюю секунду
+        self._chat_last: Dict[int, float] = {}     # время последнего принятого сообщения в чат
+        self._transports: set = set()              # разные TCP-соединения клиентов
+        self._message_id = 0
+        self._started = time.monotonic()
+
+    # --- лимиты ---
+
+    def _retry_after(self, chat_id: int, now: float) -> Tuple[Optional[int], str]:
+        """retry_after (целые секунды, как у Telegram) и какой лимит превышен; None — можно отправлять"""
+        while self._window and now - self._window[0] >= 1:
+            self._window.popleft()
+        if self.global_rate and len(self._window) >= self.global_rate:
+            return max(1, math.ceil(1 - (now - self._window[0]))), "global"
+        last = self._chat_last.get(chat_id)
+        if self.chat_rate and last is not None and now - last < 1 / self.chat_rate:
+            return max(1, math.ceil(1 / self.chat_rate - (now - last))), "chat"
+        return None, ""
+
+    # --- обработчики ---
+
+    async def _sleep(self) -> None:
+        delay = self.latency + (random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.counters["requests"] += 1
+        self._transports.add(id(request.transport))
+        self.methods[method] += 1
+        data = dict(await request.post())
+        await self._sleep()
+
+        if method.lower() != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(data["chat_id"])
+        now = time.monotonic()
+        retry_after, limit = self._retry_after(chat_id, now)
+        if retry_after is not None:
+            self.counters[f"rate_limited_{limit}"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }, status=429)
+
+        self._window.append(now)
+        self._chat_last[chat_id] = now
+        self._message_id += 1
+        self.counters["sent"] += 1
+        self.messages.append({"chat_id": chat_id, "text": data.get("text"), "at": now - self._started,
+                              "reply_markup": data.get("reply_markup")})
+        return web.json_response({"ok": True, "result": {
+            "message_id": self._message_id, "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+
+    async def handle_counters(self, request: web.Request) -> web.Response:
+        elapsed = time.monotonic() - self._started
+        return web.json_response({
+            **self.counters, "methods": dict(self.methods), "chats": len(self._chat_last),
+            "connections": len(self._transports),
+            "elapsed": round(elapsed, 3),
+        })
+
+    async def handle_messages(self, request: web.Request) -> web.Response:
+        chat_id = request.query.get("chat_id")
+        messages = [m for m in self.messages if chat_id is None or m["chat_id"] == int(chat_id)]
+        return web.json_response(messages)
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset()
+        return web.json_response({"ok": True})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/counters", self.handle_counters)
+        app.router.add_get("/messages", self.handle_messages)
+        app.router.add_post("/reset", self.handle_reset)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        return app
+
+
+async def start_fake_bot_api(api: FakeBotApi, host: str = "127.0.0.1", port: int = 0) -> Tuple[web.AppRunner, str]:
+    """Запускает сервер в текущем event loop; возвращает runner (для cleanup) и базовый URL"""
+    runner = web.AppRunner(api.make_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--global-rate", type=float, default=TELEGRAM_GLOBAL_RATE, help="0 — без лимита")
+    parser.add_argument("--chat-rate", type=float, default=TELEGRAM_CHAT_RATE, help="0 — без лимита")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--keep", type=int, default=100_000)
+    args = parser.parse_args()
+
+    api = FakeBotApi(args.global_rate, args.chat_rate, args.latency_ms, args.jitter_ms, args.keep)
+    web.run_app(api.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Рассылка о завершении события N участникам через настоящий путь доставки:
+строки outbox (event_finalized_participant) -> OutboxWorker._deliver (рендер из кеша шаблонов)
+-> диспетчер с лимитами -> BotSession -> фейковый Bot API (bench.fake_bot_api).
+
+БД не нужна: строки, которые вернул бы claim_batch, собираются в памяти, пачки по
+--batch-size разбирают --workers корутин, как в OutboxWorker.run_once.
+
+С лимитами Telegram (30 сообщений/с) 10k участников — это ~5.5 минут; проверяем,
+что диспетчер не получает 429 и держит темп. С поднятыми лимитами (--rate 2000)
+видно собственную стоимость пути доставки на сообщение.
+
+Запуск из каталога server:
+    python -m bench.fanout_bench --participants 10000
+    python -m bench.fanout_bench --participants 10000 --rate 2000 --latency-ms 20
+    python -m bench.fanout_bench --api-url http://127.0.0.1:8081   # сервер в отдельном процессе
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+import httpx
+from aiogram.client.telegram import TelegramAPIServer
+
+from bench.fake_bot_api import TELEGRAM_CHAT_RATE, TELEGRAM_GLOBAL_RATE, FakeBotApi, start_fake_bot_api
+from bot import telegram_bot
+from codec import dumps
+from dispatcher import NOTIFY_RETRY_AFTER, dispatcher
+from outbox import OutboxWorker
+
+FIRST_CHAT_ID = 1_000_000_000
+
+
+def make_rows(participants: int, chats: int, seed: int) -> List[Dict[str, Any]]:
+    """Строки outbox одной рассылки: payload общий, различаются chat_id и язык"""
+    rnd = random.Random(seed)
+    payload = dumps({
+        "event": {"id": 1, "title": "Встреча выпускников", "public_id": "0190f5f6-7a1b-7cde-8f00-000000000001"},
+        "final_slot": {"id": 42, "slot_start": datetime(2026, 11, 3, 15, 30, tzinfo=timezone.utc).isoformat()},
+    }).decode()
+    return [
+        {"id": i + 1, "kind": "event_finalized_participant", "chat_id": FIRST_CHAT_ID + i % chats,
+         "language_code": "ru" if rnd.random() < 0.6 else "en", "payload": payload, "attempts": 1}
+        for i in range(participants)
+    ]
+
+
+async def drain(rows: List[Dict[str, Any]], workers: int, batch_size: int) -> Dict[str, int]:
+    worker = OutboxWorker(database=None)
+    batches = [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+    outcome = {"sent": 0, "failed": 0}
+
+    async def run():
+        while batches:
+            batch = batches.pop(0)
+            results = await asyncio.gather(*(worker._deliver(row) for row in batch), return_exceptions=True)
+            for result in results:
+                outcome["sent" if result is None else "failed"] += 1
+
+    await asyncio.gather(*(run() for _ in range(workers)))
+    return outcome
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--participants", type=int, default=10_000)
+    parser.add_argument("--rate", type=float,
+                        help="общий лимит сообщений/с и у диспетчера, и у сервера; по умолчанию "
+                             "NOTIFY_GLOBAL_RATE у диспетчера и лимит Telegram у сервера")
+    parser.add_argument("--chat-rate", type=float, help="то же для лимита на чат")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--chats", type=int, help="меньше участников — несколько сообщений в чат (лимит на чат)")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--api-url", help="уже запущенный fake_bot_api; по умолчанию поднимается в этом процессе")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    runner = None
+    base_url = args.api_url
+    if base_url is None:
+        api = FakeBotApi(args.rate or TELEGRAM_GLOBAL_RATE, args.chat_rate or TELEGRAM_CHAT_RATE,
+                         args.latency_ms, args.jitter_ms, keep=args.participants)
+        runner, base_url = await start_fake_bot_api(api)
+    telegram_bot.bot.session.api = TelegramAPIServer.from_base(base_url)
+    # лимиты читаются при старте диспетчера
+    dispatcher.global_rate = args.rate or dispatcher.global_rate
+    dispatcher.chat_rate = args.chat_rate or dispatcher.chat_rate
+
+    rows = make_rows(args.participants, args.chats or args.participants, args.seed)
+    dispatcher.start()
+    started = time.perf_counter()
+    try:
+        outcome = await drain(rows, args.workers, args.batch_size)
+        elapsed = time.perf_counter() - started
+        await dispatcher.stop()
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            counters = (await client.get("/counters")).json()
+    finally:
+        await telegram_bot.bot.session.close()
+        if runner is not None:
+            await runner.cleanup()
+
+    print(f"participants      {args.participants}")
+    print(f"elapsed           {elapsed:.1f}s  ({outcome['sent'] / elapsed:.1f} msg/s, limit {dispatcher.global_rate:g})")
+    print(f"sent / failed     {outcome['sent']} / {outcome['failed']}")
+    print(f"server accepted   {counters.get('sent', 0)}  over {counters.get('connections', 0)} connections")
+    print(f"server 429        global={counters.get('rate_limited_global', 0)} "
+          f"chat={counters.get('rate_limited_chat', 0)}  (dispatcher RetryAfter={NOTIFY_RETRY_AFTER.value():.0f})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
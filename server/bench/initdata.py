@@ -0,0 +1,37 @@
+"""
+Подписанный Telegram WebApp initData для нагрузочных тестов.
+
+Подпись считается так же, как это делает Telegram (HMAC-SHA256 с ключом из токена бота),
+поэтому сервер, запущенный с тем же тестовым BOT_TOKEN, принимает её без изменений в коде.
+"""
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+# Формат токена должен пройти проверку aiogram ("<digits>:<secret>")
+TEST_BOT_TOKEN = "123456789:LOADTEST-timetally-token"
+
+
+def sign_init_data(bot_token: str, fields: dict) -> str:
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    signature = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode({**fields, "hash": signature})
+
+
+def make_init_data(telegram_user_id: int, bot_token: str = TEST_BOT_TOKEN, language_code: str = "en") -> str:
+    user = {
+        "id": telegram_user_id,
+        "first_name": f"Load{telegram_user_id}",
+        "last_name": "Test",
+        "username": f"load_{telegram_user_id}",
+        "language_code": language_code,
+        "allows_write_to_pm": True,
+    }
+    return sign_init_data(bot_token, {
+        "auth_date": str(int(time.time())),
+        "query_id": f"loadtest-{telegram_user_id}",
+        "user": json.dumps(user, separators=(",", ":"), ensure_ascii=False),
+    })
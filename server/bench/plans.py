@@ -0,0 +1,317 @@
+"""
+Регрессия планов запросов db.py.
+
+Прогоняет функции db.py с репрезентативными параметрами на сгенерированном наборе
+(bench.datagen), перехватывает каждый запрос и перед выполнением делает для него
+EXPLAIN (ANALYZE, BUFFERS) в откатываемом savepoint. Каждый сценарий выполняется
+в транзакции, которая откатывается, поэтому данные не меняются.
+
+Нормализованные планы (типы узлов, таблицы, индексы — без стоимостей и времени)
+и число затронутых shared-буферов сравниваются с bench/plan_baseline.json.
+Проверка падает (код 1), если:
+- сценарий упал с исключением (его запросы не попали в замер);
+- запрос из baseline больше не выполняется ни одним сценарием ("gone");
+- запрос читает event_votes/event_slots через Seq Scan;
+- буферов больше, чем budget запроса в baseline (или --default-budget для новых запросов).
+Смена формы плана только печатается.
+
+Baseline зависит от набора данных, поэтому в репозитории его нет — он создаётся один раз
+на стенде и затем коммитится (bench/plan_baseline.json), чтобы проверки сравнивались с ним:
+    python -m bench.datagen --db-url ... --truncate --users 200000 --votes-per-slot 5
+    python -m bench.plans --db-url ... --update   # записать baseline (budget существующих сохраняется)
+    git add bench/plan_baseline.json
+Без baseline проверяются только Seq Scan и --default-budget. Проверка (из каталога server):
+    python -m bench.plans --db-url ...
+--update не пишет baseline, если какой-то сценарий упал.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import asyncpg
+
+import db
+from models import EventCreate, EventUpdate, WebAppUser
+
+BASELINE_PATH = Path(__file__).resolve().parent / "plan_baseline.json"
+GUARDED_TABLES = ("event_votes", "event_slots")
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+class _Rollback(Exception):
+    pass
+
+
+def query_fingerprint(query: str) -> str:
+    return hashlib.sha1(" ".join(query.split()).encode()).hexdigest()[:12]
+
+
+def normalize_plan(node: dict, depth: int = 0) -> List[str]:
+    """Форма плана без стоимостей/времени: по строке на узел"""
+    parts = [node["Node Type"]]
+    if node.get("Join Type"):
+        parts.append(node["Join Type"])
+    if node.get("Index Name"):
+        parts.append(f"using {node['Index Name']}")
+    if node.get("Relation Name"):
+        parts.append(f"on {node['Relation Name']}")
+    lines = ["  " * depth + " ".join(parts)]
+    for child in node.get("Plans", ()):
+        lines.extend(normalize_plan(child, depth + 1))
+    return lines
+
+
+def seq_scans(node: dict) -> List[str]:
+    found = []
+    if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in GUARDED_TABLES:
+        found.append(node["Relation Name"])
+    for child in node.get("Plans", ()):
+        found.extend(seq_scans(child))
+    return found
+
+
+class PlanCaptureConnection(asyncpg.Connection):
+    """Соединение, которое делает EXPLAIN ANALYZE каждого запроса перед его выполнением"""
+
+    def _init_capture(self):
+        self.capturing = False
+        self.samples: Dict[str, dict] = {}
+
+    async def _explain(self, caller: str, query: str, args: tuple):
+        if not getattr(self, "capturing", False) or not query.lstrip().upper().startswith(EXPLAINABLE):
+            return
+        plan = None
+        try:
+            async with self.transaction():
+                raw = await asyncpg.Connection.fetchval(
+                    self, "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, *args
+                )
+                plan = json.loads(raw)[0]["Plan"]
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        key = f"{caller}:{query_fingerprint(query)}"
+        buffers = plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0)
+        sample = {
+            "function": caller,
+            "query": " ".join(query.split())[:300],
+            "plan": normalize_plan(plan),
+            "seq_scans": sorted(set(seq_scans(plan))),
+            "buffers": buffers,
+            "rows": plan.get("Actual Rows", 0),
+        }
+        previous = self.samples.get(key)
+        # один и тот же запрос в цикле — оставляем самый тяжёлый прогон
+        if previous is None or previous["buffers"] < buffers:
+            self.samples[key] = sample
+
+    async def execute(self, query: str, *args, timeout: float = None) -> str:
+        if args:
+            await self._explain(db._query_caller(), query, args)
+        return await super().execute(query, *args, timeout=timeout)
+
+    async def executemany(self, command: str, args, *, timeout: float = None):
+        args = list(args)
+        if args:
+            await self._explain(db._query_caller(), command, tuple(args[0]))
+        return await super().executemany(command, args, timeout=timeout)
+
+    async def fetch(self, query: str, *args, timeout: float = None, record_class=None) -> list:
+        await self._explain(db._query_caller(), query, args)
+        return await super().fetch(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchrow(self, query: str, *args, timeout: float = None, record_class=None):
+        await self._explain(db._query_caller(), query, args)
+        return await super().fetchrow(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchval(self, query: str, *args, column: int = 0, timeout: float = None):
+        await self._explain(db._query_caller(), query, args)
+        return await super().fetchval(query, *args, column=column, timeout=timeout)
+
+
+async def pick_params(conn: asyncpg.Connection) -> dict:
+    """Самые тяжёлые сущности набора: популярное событие, активный участник, удалённое событие"""
+    event = await conn.fetchrow("""
+        SELECT e.id, e.public_id, u.telegram_user_id AS creator_tg, u.id AS creator_id
+        FROM events e
+        JOIN users u ON u.id = e.user_id
+        JOIN LATERAL (SELECT COUNT(*) AS votes FROM event_votes v WHERE v.event_id = e.id) v ON TRUE
+        WHERE e.deleted_at IS NULL AND e.final_slot_id IS NULL
+        ORDER BY v.votes DESC
+        LIMIT 1
+    """)
+    if event is None:
+        raise SystemExit("Dataset is empty, run bench.datagen first")
+    slot_ids = [r["id"] for r in await conn.fetch(
+        "SELECT id FROM event_slots WHERE event_id = $1 AND deleted_at IS NULL ORDER BY slot_start", event["id"]
+    )]
+    slots = await conn.fetch(
+        "SELECT id, slot_start FROM event_slots WHERE event_id = $1 AND deleted_at IS NULL", event["id"]
+    )
+    voter_tg = await conn.fetchval("""
+        SELECT u.telegram_user_id
+        FROM users u
+        JOIN event_votes v ON v.user_id = u.id
+        GROUP BY u.telegram_user_id
+        ORDER BY COUNT(*) DESC
+        LIMIT 1
+    """)
+    deleted = await conn.fetchrow("""
+        SELECT e.id, u.telegram_user_id AS creator_tg
+        FROM events e JOIN users u ON u.id = e.user_id
+        WHERE e.deleted_at IS NOT NULL
+        LIMIT 1
+    """)
+    return {
+        "event_id": event["id"], "public_id": str(event["public_id"]), "creator_tg": event["creator_tg"],
+        "creator_id": event["creator_id"], "slot_ids": slot_ids, "slots": slots,
+        "voter_tg": voter_tg or event["creator_tg"], "deleted": deleted,
+    }
+
+
+async def calendar_feed_version(conn: asyncpg.Connection, telegram_user_id: int):
+    token = await db.get_calendar_token(conn, telegram_user_id)
+    return await db.get_calendar_feed_version(conn, token)
+
+
+def scenarios(conn: asyncpg.Connection, p: dict):
+    event_id, creator_tg, voter_tg = p["event_id"], p["creator_tg"], p["voter_tg"]
+    tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+    event_update = EventUpdate.model_validate({
+        "event": {"id": event_id, "public_id": p["public_id"], "title": "Plan check", "location": "Zoom"},
+        "slots": [{"id": s["id"], "slot_start": s["slot_start"]} for s in p["slots"]] + [
+            {"id": None, "slot_start": tomorrow}
+        ],
+        "deletedSlotIds": [],
+    })
+    event_create = EventCreate.model_validate({
+        "title": "Plan check", "timezone": "Europe/Moscow",
+        "dates": [{"date": f"{tomorrow.date()}T00:00:00", "timeSlots": ["10:00", "10:30", "11:00"]}],
+    })
+    user = WebAppUser(telegram_user_id=voter_tg, username="plancheck", language_code="ru")
+
+    yield "create_or_update_user", lambda: db.create_or_update_user(conn, user)
+    yield "get_active_user_events", lambda: db.get_active_user_events(conn, voter_tg)
+    yield "get_archived_user_events", lambda: db.get_archived_user_events(conn, voter_tg)
+    yield "get_event_details_db", lambda: db.get_event_details_db(conn, voter_tg, event_id)
+    yield "get_event_by_public_id", lambda: db.get_event_by_public_id(conn, voter_tg, p["public_id"])
+    yield "get_event_calendar_version", lambda: db.get_event_calendar_version(conn, p["public_id"])
+    yield "get_event_calendar_db", lambda: db.get_event_calendar_db(conn, p["public_id"])
+    yield "get_calendar_feed_version", lambda: calendar_feed_version(conn, voter_tg)
+    yield "get_event_by_id", lambda: db.get_event_by_id(conn, event_id, voter_tg)
+    yield "get_slots", lambda: db.get_slots(conn, event_id)
+    yield "check_event_export_permissions", lambda: db.check_event_export_permissions(conn, event_id, creator_tg)
+    yield "get_event_voters_db", lambda: db.get_event_voters_db(conn, event_id)
+    yield "check_event_ownership", lambda: db.check_event_ownership(conn, event_id, p["creator_id"])
+    yield "check_slots_have_votes", lambda: db.check_slots_have_votes(conn, p["slot_ids"])
+    yield "submit_votes_db", lambda: db.submit_votes_db(conn, event_id, voter_tg, p["slot_ids"][:1])
+    yield "validate_event_update_permissions", lambda: db.validate_event_update_permissions(
+        conn, event_update, creator_tg)
+    yield "update_event_data", lambda: db.update_event_data(conn, event_update, creator_tg)
+    yield "update_event_location_on_finalize", lambda: db.update_event_location_on_finalize(conn, event_id, "Zoom")
+    yield "finalized_event_db", lambda: db.finalized_event_db(conn, event_id, creator_tg, p["slot_ids"][0])
+    yield "delete_event_db", lambda: db.delete_event_db(conn, creator_tg, event_id)
+    if p["deleted"] is not None:
+        yield "restore_event_db", lambda: db.restore_event_db(conn, p["deleted"]["creator_tg"], p["deleted"]["id"])
+    yield "create_event", lambda: db.create_event(conn, event_create, creator_tg)
+
+
+async def collect(db_url: str) -> Tuple[Dict[str, dict], List[str]]:
+    """Планы запросов по сценариям и список упавших сценариев"""
+    conn = await asyncpg.connect(db_url, connection_class=PlanCaptureConnection)
+    conn._init_capture()
+    errors: List[str] = []
+    try:
+        params = await pick_params(conn)
+        for name, run in scenarios(conn, params):
+            transaction = conn.transaction()
+            await transaction.start()
+            conn.capturing = True
+            try:
+                await run()
+            except Exception as e:
+                errors.append(f"scenario {name} failed: {type(e).__name__}: {e}")
+                print(f"[plans] {errors[-1]}")
+            finally:
+                conn.capturing = False
+                await transaction.rollback()
+    finally:
+        await conn.close()
+    return conn.samples, errors
+
+
+def compare(samples: Dict[str, dict], baseline: Dict[str, dict], default_budget: int,
+            allow_gone: bool = False) -> List[str]:
+    failures = []
+    for key, sample in sorted(samples.items()):
+        known = baseline.get(key)
+        budget = known["budget"] if known else default_budget
+        status = "ok"
+        if sample["seq_scans"]:
+            status = "FAIL"
+            failures.append(f"{key}: Seq Scan on {', '.join(sample['seq_scans'])}")
+        if sample["buffers"] > budget:
+            status = "FAIL"
+            failures.append(f"{key}: {sample['buffers']} buffers > budget {budget}")
+        if known is None:
+            note = "new"
+        elif known["plan"] != sample["plan"]:
+            note = "plan changed"
+        else:
+            note = ""
+        print(f"{status:<5}{key:<55}{sample['buffers']:>9}/{budget:<9}{note}")
+        if note == "plan changed":
+            print("      was:\n        " + "\n        ".join(known["plan"]))
+            print("      now:\n        " + "\n        ".join(sample["plan"]))
+    for key in sorted(set(baseline) - set(samples)):
+        print(f"gone {key}")
+        if not allow_gone:
+            failures.append(f"{key}: no longer executed (renamed or removed? re-run with --update)")
+    return failures
+
+
+def updated_baseline(samples: Dict[str, dict], baseline: Dict[str, dict], default_budget: int) -> Dict[str, dict]:
+    result = {}
+    for key, sample in sorted(samples.items()):
+        known = baseline.get(key)
+        # budget правится руками; для новых — запас в два раза от текущего
+        budget = known["budget"] if known else max(default_budget, 2 * sample["buffers"])
+        result[key] = {**sample, "budget": budget}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db-url", required=True)
+    parser.add_argument("--baseline", default=str(BASELINE_PATH))
+    parser.add_argument("--update", action="store_true", help="перезаписать baseline текущими планами")
+    parser.add_argument("--default-budget", type=int, default=1000, help="буферов на запрос без baseline")
+    args = parser.parse_args()
+
+    baseline_path = Path(args.baseline)
+    baseline: Dict[str, dict] = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+    if not baseline and not args.update:
+        print(f"[plans] no baseline at {baseline_path}, checking Seq Scans and --default-budget only "
+              f"(create it with --update, see module docstring)")
+    samples, errors = asyncio.run(collect(args.db_url))
+    failures = errors + compare(samples, baseline, args.default_budget, allow_gone=args.update)
+
+    if args.update and errors:
+        print("Baseline not written: some scenarios failed")
+    elif args.update:
+        baseline_path.write_text(json.dumps(updated_baseline(samples, baseline, args.default_budget),
+                                            indent=2, ensure_ascii=False) + "\n")
+        print(f"Baseline written to {baseline_path}")
+    if failures:
+        print("\n".join(["", "Plan regressions:"] + failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
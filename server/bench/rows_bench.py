@@ -0,0 +1,68 @@
+"""
+Стоимость одной строки списка событий: полная валидация pydantic, model_construct
+и доверенный путь db._trusted_rows (вместе с сериализацией ответа).
+
+Запуск из каталога server:
+    python -m bench.rows_bench --rows 500 --repeat 200
+"""
+import argparse
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from codec import dumps
+from db import _trusted_rows
+from fastapi.encoders import jsonable_encoder
+from models import ArchivedEventResponse
+
+
+def make_rows(n: int) -> list[dict]:
+    # dict ведёт себя как asyncpg.Record для record[key]
+    now = datetime.now()
+    return [
+        {"id": i, "public_id": uuid4(), "title": f"Event {i}", "event_type": "poll" if i % 3 else "booking",
+         "final_slot_id": i if i % 4 == 0 else None, "is_creator": bool(i % 2), "created_at": now,
+         "is_deleted": False, "is_expired": i % 4 == 0, "participant_count": i % 70}
+        for i in range(n)
+    ]
+
+
+def validated(rows):
+    # прежний путь: Model(**record) -> dict(model) -> jsonable_encoder -> json
+    return dumps(jsonable_encoder([dict(ArchivedEventResponse(**r)) for r in rows]))
+
+
+def constructed(rows):
+    return dumps([dict(ArchivedEventResponse.model_construct(**r)) for r in rows])
+
+
+def trusted(rows):
+    return dumps(_trusted_rows(rows, ArchivedEventResponse))
+
+
+def per_row_us(fn, rows, repeat: int) -> float:
+    fn(rows)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(rows)
+    return (time.perf_counter() - start) / (repeat * len(rows)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    assert trusted(rows) == validated(rows), "trusted path must produce the same JSON"
+
+    baseline = per_row_us(validated, rows, args.repeat)
+    print(f"{'path':<16}{'us/row':>10}{'speedup':>10}")
+    for name, fn in (("validated", validated), ("model_construct", constructed), ("trusted", trusted)):
+        cost = per_row_us(fn, rows, args.repeat)
+        print(f"{name:<16}{cost:>10.2f}{baseline / cost:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Разбор апдейта Telegram в webhook: старый путь против model_validate_json по сырым байтам.
+
+Старый путь: request.json() -> Update(**dict) -> в feed_update апдейт без бота
+пересобирается через model_dump() + model_validate(context={"bot": ...}).
+Новый: Update.model_validate_json(raw, context={"bot": ...}) — один проход, бот уже привязан.
+
+Апдейты — записанные образцы (/start с параметром, сообщение с entities и reply, callback_query,
+my_chat_member); свои можно передать файлом JSON lines (по апдейту на строку).
+
+Запуск из каталога server:
+    python -m bench.update_parse_bench --iterations 20000
+    python -m bench.update_parse_bench --file updates.jsonl
+"""
+import argparse
+import json
+import time
+
+from aiogram import Bot
+from aiogram.types import Update
+
+from codec import parse_model
+
+SAMPLES = [
+    {"update_id": 815000001, "message": {
+        "message_id": 4412, "date": 1760870400,
+        "from": {"id": 287565447, "is_bot": False, "first_name": "Алексей", "last_name": "Специальный",
+                 "username": "special_user", "language_code": "ru", "is_premium": True},
+        "chat": {"id": 287565447, "first_name": "Алексей", "last_name": "Специальный", "username": "special_user",
+                 "type": "private"},
+        "text": "/start ev_0190f5f6-7a1b-7cde-8f00-000000000001",
+        "entities": [{"offset": 0, "length": 6, "type": "bot_command"}]}},
+    {"update_id": 815000002, "message": {
+        "message_id": 4413, "date": 1760870460,
+        "from": {"id": 111111111, "is_bot": False, "first_name": "Иван", "username": "ivan_ivanov",
+                 "language_code": "ru"},
+        "chat": {"id": 111111111, "first_name": "Иван", "username": "ivan_ivanov", "type": "private"},
+        "text": "Когда встречаемся? Смотри https://t.me/meety_bot/app и отметься @petr_petrov",
+        "entities": [{"offset": 27, "length": 26, "type": "url"},
+                     {"offset": 64, "length": 12, "type": "mention"}],
+        "reply_to_message": {
+            "message_id": 4401, "date": 1760860000,
+            "from": {"id": 6000000001, "is_bot": True, "first_name": "Meety", "username": "meety_bot"},
+            "chat": {"id": 111111111, "first_name": "Иван", "username": "ivan_ivanov", "type": "private"},
+            "text": "Событие завершено"}}},
+    {"update_id": 815000003, "callback_query": {
+        "id": "1234567890123456789", "chat_instance": "-8811223344556677",
+        "from": {"id": 333333333, "is_bot": False, "first_name": "Anna", "last_name": "Smith",
+                 "username": "anna_smith", "language_code": "en"},
+        "message": {
+            "message_id": 4420, "date": 1760870500,
+            "from": {"id": 6000000001, "is_bot": True, "first_name": "Meety", "username": "meety_bot"},
+            "chat": {"id": 333333333, "first_name": "Anna", "username": "anna_smith", "type": "private"},
+            "text": "Event finalized",
+            "reply_markup": {"inline_keyboard": [[{"text": "Open event", "web_app": {
+                "url": "https://app.example/event/public/0190f5f6-7a1b-7cde-8f00-000000000001"}}]]}},
+        "data": "open:0190f5f6-7a1b-7cde-8f00-000000000001"}},
+    {"update_id": 815000004, "my_chat_member": {
+        "chat": {"id": 222222222, "first_name": "Пётр", "username": "petr_petrov", "type": "private"},
+        "from": {"id": 222222222, "is_bot": False, "first_name": "Пётр", "username": "petr_petrov",
+                 "language_code": "ru"},
+        "date": 1760870600,
+        "old_chat_member": {"status": "member",
+                            "user": {"id": 6000000001, "is_bot": True, "first_name": "Meety",
+                                     "username": "meety_bot"}},
+        "new_chat_member": {"status": "kicked", "until_date": 0,
+                            "user": {"id": 6000000001, "is_bot": True, "first_name": "Meety",
+                                     "username": "meety_bot"}}}},
+]
+
+
+def dict_path(raw: bytes, bot: Bot) -> Update:
+    return Update(**json.loads(raw))
+
+
+def old_path(raw: bytes, bot: Bot) -> Update:
+    update = Update(**json.loads(raw))
+    # то, что делал feed_update для апдейта без привязанного бота
+    return Update.model_validate(update.model_dump(), context={"bot": bot})
+
+
+def new_path(raw: bytes, bot: Bot) -> Update:
+    return parse_model(Update, raw, context={"bot": bot})
+
+
+def bench(fn, payloads, bot: Bot, iterations: int) -> float:
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(payloads[i % len(payloads)], bot)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--file", help="JSON lines с записанными апдейтами")
+    args = parser.parse_args()
+
+    if args.file:
+        with open(args.file, "rb") as f:
+            payloads = [line.strip() for line in f if line.strip()]
+    else:
+        payloads = [json.dumps(sample, ensure_ascii=False).encode() for sample in SAMPLES]
+    bot = Bot(token="123456:bench")
+
+    for raw in payloads:
+        assert old_path(raw, bot) == new_path(raw, bot), "parsers disagree"
+
+    bench(new_path, payloads, bot, 1000)  # прогрев
+    old = bench(old_path, payloads, bot, args.iterations)
+    parse_only = bench(dict_path, payloads, bot, args.iterations)
+    new = bench(new_path, payloads, bot, args.iterations)
+    print(f"{'path':<28}{'us/update':>10}{'speedup':>10}")
+    print(f"{'json + Update(**) + remount':<28}{old:>10.1f}{1:>9.1f}x")
+    print(f"{'  json + Update(**) only':<28}{parse_only:>10.1f}{old / parse_only:>9.1f}x")
+    print(f"{'model_validate_json':<28}{new:>10.1f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
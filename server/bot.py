@@ -1,11 +1,18 @@
+"""
+Всё, что связано с aiogram. Сам aiogram импортируется ~1.5 с (дерево типов), поэтому main
+не импортирует этот модуль сверху: он загружается в lifespan в потоке, параллельно с подключением к БД.
+"""
 import logging
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
 from aiogram import Bot, Dispatcher
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
 from aiogram.types import Update, Message
 from aiogram.utils.web_app import safe_parse_webapp_init_data, WebAppInitData
 
-from config import BOT_TOKEN, WEBHOOK_PATH, WEBHOOK_SECRET
+from bot_session import BotSession
+from codec import parse_model
+from config import BOT_API_URL, BOT_TOKEN, WEBHOOK_PATH, WEBHOOK_SECRET
 from router import router
 
 # Configure logging
@@ -17,19 +24,28 @@ BOT_TOKEN = BOT_TOKEN
 WEBHOOK_SECRET = WEBHOOK_SECRET
 WEBHOOK_PATH = WEBHOOK_PATH
 
-# Initialize bot and dispatcher
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-
-dp.include_router(router)
-
 
 class TelegramBot:
     def __init__(self):
-        self.bot = bot
-        self.dp = dp
+        self._bot: Optional[Bot] = None
+        self._dp: Optional[Dispatcher] = None
         # self.setup_handlers()
 
+    @property
+    def bot(self) -> Bot:
+        # создаётся при первом обращении: импорт модуля не проверяет токен и не собирает сессию
+        if self._bot is None:
+            api_server = TelegramAPIServer.from_base(BOT_API_URL) if BOT_API_URL else PRODUCTION
+            self._bot = Bot(token=BOT_TOKEN, session=BotSession(api=api_server))
+        return self._bot
+
+    @property
+    def dp(self) -> Dispatcher:
+        if self._dp is None:
+            self._dp = Dispatcher()
+            self._dp.include_router(router)
+        return self._dp
+
     # def setup_handlers(self):
     #     @self.dp.message()
     #     async def echo_handler(msg: Message) -> None:
@@ -55,9 +71,13 @@ class TelegramBot:
         except Exception as e:
             logger.error(f"Failed to delete webhook: {e}")
 
-    async def process_update(self, update_data: Dict[str, Any]):
+    def parse_update(self, raw: bytes) -> Update:
+        # Один проход pydantic по сырым байтам, бот привязан сразу —
+        # иначе feed_update пересобирает апдейт через model_dump/model_validate
+        return parse_model(Update, raw, context={"bot": self.bot})
+
+    async def process_update(self, update: Update):
         try:
-            update = Update(**update_data)
             await self.dp.feed_update(bot=self.bot, update=update)
         except Exception as e:
             logger.error(f"Error processing update: {e}")
@@ -1,485 +1,232 @@
 from aiogram.types import InlineKeyboardMarkup, WebAppInfo, InlineKeyboardButton
-from typing import Dict, Any
-import asyncio
-
-from bot import telegram_bot
-from config import CLIENT_URL
-
-
-def _is_ru(lang: str | None) -> bool:
-    return (lang or "en").lower().startswith("ru")
-
-
-def _get(obj, key):
-    if obj is None:
-        return None
-    if isinstance(obj, dict):
-        return obj.get(key)
-    return getattr(obj, key, None)
+from datetime import datetime
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Mapping, NamedTuple, Optional, Tuple
 
+from pydantic import PrivateAttr
 
-async def send_event_created_pm(user, event):
-    # язык
-    lang = (getattr(user, "language_code", None) or "en").lower()
-    is_ru = lang.startswith("ru")
-
-    # данные события (аккуратно достаём поля)
-    title = (getattr(event, "title", None) or "Untitled").strip()
-    description = (getattr(event, "description", None) or "").strip()
-    public_id = getattr(event, "public_id", None)
-
-    # заголовок и текст
-    if is_ru:
-        header = "Событие создано ✅"
-        desc_text = f"\n{description}" if description else "\nОписание отсутствует."
-        btn_text = "Открыть событие"
-    else:
-        header = "Event created ✅"
-        desc_text = f"\n{description}" if description else "\nNo description."
-        btn_text = "Open event"
+from codec import loads
+from config import CLIENT_URL
+from slot_times import get_zone
+
+# Тексты уведомлений. Шаблон выбирается по (kind строки notification_outbox, язык);
+# поля для подстановки достаёт из payload билдер этого kind (см. db.enqueue_notification).
+# Готовое сообщение кешируется по (kind, язык, сырой payload): при рассылке участникам
+# строки отличаются только chat_id, поэтому рендер идёт один раз на событие и язык.
+
+# Сколько голосовавших перечисляем в сводке, остальные — «и ещё N»
+DIGEST_MAX_VOTERS = 10
+# Сколько слотов с голосами показываем в итогах (лимит длины сообщения Telegram)
+DIGEST_MAX_SLOTS = 20
+# Сколько разных готовых сообщений держим в кеше
+RENDER_CACHE_SIZE = 4096
+
+
+class Template(NamedTuple):
+    text: str                         # str.format-шаблон с полями из билдера
+    button: Optional[str] = None      # текст кнопки, открывающей webApp; None — без кнопки
+    extra: Mapping[str, str] = {}     # локализованные фрагменты, которые нужны билдеру
+
+
+def _lang_key(lang: str | None) -> str:
+    return "ru" if (lang or "en").lower().startswith("ru") else "en"
+
+
+OPEN_EVENT = {"ru": "Открыть событие", "en": "Open event"}
+
+TEMPLATES: Dict[Tuple[str, str], Template] = {
+    ("event_created", "ru"): Template(
+        "<b>Событие создано ✅</b>\n\n<b>{title}</b>\n{description}", OPEN_EVENT["ru"],
+        {"no_description": "Описание отсутствует."}),
+    ("event_created", "en"): Template(
+        "<b>Event created ✅</b>\n\n<b>{title}</b>\n{description}", OPEN_EVENT["en"],
+        {"no_description": "No description."}),
+    # без кнопок/ссылок
+    ("event_deleted", "ru"): Template(
+        "<b>Событие удалено ❌</b>\n\n<b>{title}</b>\nID: {id}\n\nСобытие удалено и больше недоступно."),
+    ("event_deleted", "en"): Template(
+        "<b>Event deleted ❌</b>\n\n<b>{title}</b>\nID: {id}\n\nThe event has been deleted and is no longer available."),
+    ("event_updated", "ru"): Template("<b>Событие обновлено ✏️</b>\n\n<b>{title}</b>{description}\nID: {id}",
+                                      OPEN_EVENT["ru"]),
+    ("event_updated", "en"): Template("<b>Event updated ✏️</b>\n\n<b>{title}</b>{description}\nID: {id}",
+                                      OPEN_EVENT["en"]),
+    ("event_updated_participant", "ru"): Template("<b>Событие обновлено ✏️</b>\n\n«{title}»\nID: {id}",
+                                                  OPEN_EVENT["ru"]),
+    ("event_updated_participant", "en"): Template("<b>Event updated ✏️</b>\n\n“{title}”\nID: {id}",
+                                                  OPEN_EVENT["en"]),
+    # Пример: В событии «Название» новый ответ от Имя Фамилия | @username
+    ("vote_creator", "ru"): Template("<b>Новый ответ по событию</b>\n\n«{title}»\nОт: {voter}", OPEN_EVENT["ru"]),
+    ("vote_creator", "en"): Template("<b>New response on event</b>\n\n“{title}”\nFrom: {voter}", OPEN_EVENT["en"]),
+    ("vote_digest", "ru"): Template("<b>{header}</b>\n\n«{title}»\nОт: {voters}{tallies}", OPEN_EVENT["ru"], {
+        "header_one": "Новый ответ по событию", "header_many": "Новые ответы по событию: {count}",
+        "more": "и ещё {count}", "tallies": "<b>Голоса по слотам</b>"}),
+    ("vote_digest", "en"): Template("<b>{header}</b>\n\n“{title}”\nFrom: {voters}{tallies}", OPEN_EVENT["en"], {
+        "header_one": "New response on event", "header_many": "New responses on event: {count}",
+        "more": "and {count} more", "tallies": "<b>Votes per slot</b>"}),
+    ("vote_voter", "ru"): Template("<b>Вы оставили ответ на событие</b>\n\n«{title}»", OPEN_EVENT["ru"]),
+    ("vote_voter", "en"): Template("<b>You submitted your response for</b>\n\n“{title}”", OPEN_EVENT["en"]),
+    ("event_finalized", "ru"): Template("<b>Событие завершено</b>\n\n«{title}»\nФинальный слот: {slot}",
+                                        OPEN_EVENT["ru"]),
+    ("event_finalized", "en"): Template("<b>Event finalized</b>\n\n“{title}”\nFinal slot: {slot}", OPEN_EVENT["en"]),
+    ("event_restored", "ru"): Template("<b>Событие восстановлено</b>\n\n«{title}»\nСобытие снова доступно.",
+                                       OPEN_EVENT["ru"]),
+    ("event_restored", "en"): Template("<b>Event restored</b>\n\n“{title}”\nThe event is available again.",
+                                       OPEN_EVENT["en"]),
+}
+
+# Создателю и участникам уходит один и тот же текст
+TEMPLATE_ALIASES = {
+    "event_finalized_creator": "event_finalized",
+    "event_finalized_participant": "event_finalized",
+    "event_restored_creator": "event_restored",
+    "event_restored_participant": "event_restored",
+}
+
+
+def _title(event: Dict[str, Any]) -> str:
+    return (event.get("title") or "Untitled").strip()
+
+
+def _user_full_name(u: Dict[str, Any]) -> str:
+    first = u.get("first_name") or ""
+    last = u.get("last_name") or ""
+    return " ".join([p for p in (first.strip(), last.strip()) if p]).strip() or "Unknown"
 
-    start_url = f"{CLIENT_URL}/event/public/{public_id}"
 
-    # инлайн-кнопка, которая откроет webApp
-    markup = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text=btn_text, web_app=WebAppInfo(url=start_url))
-    ]])
+def _user_at(u: Dict[str, Any]) -> str:
+    username = u.get("username")
+    return f"@{username}" if username else ""
 
-    text = f"<b>{header}</b>\n\n<b>{title}</b>{desc_text}"
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=getattr(user, "id"),
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_event_created_pm] Failed to send PM: {e}")
+def _user_label(u: Dict[str, Any]) -> str:
+    at = _user_at(u)
+    return f"{_user_full_name(u)} | {at}" if at else _user_full_name(u)
 
 
-async def send_event_deleted_pm(user, event_like: dict | object | None, fallback_event_id: int):
-    """
-    Отправляет пользователю PM о том, что событие удалено.
-    Без каких-либо кнопок/ссылок.
-    """
-    lang = (getattr(user, "language_code", None) or "en").lower()
-    is_ru = lang.startswith("ru")
+def _event_url(public_id: str | None) -> str:
+    return f"{CLIENT_URL}/event/public/{public_id}" if public_id else f"{CLIENT_URL}/"
 
-    title = (_get(event_like, "title") or "Untitled").strip()
-    eid = _get(event_like, "id") or fallback_event_id
 
-    header = "Событие удалено ❌" if is_ru else "Event deleted ❌"
-    note = "Событие удалено и больше недоступно." if is_ru else "The event has been deleted and is no longer available."
+class CachedMarkup(InlineKeyboardMarkup):
+    """Разметка из кеша _webapp_markup: BotSession сериализует её при первой отправке и дальше берёт готовый JSON"""
+    _serialized: Optional[str] = PrivateAttr(default=None)
 
-    text = f"<b>{header}</b>\n\n<b>{title}</b>\nID: {eid}\n\n{note}"
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=getattr(user, "id"),
-            text=text,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_event_deleted_pm] Failed to send PM: {e}")
-
-
-async def send_event_updated_pm(user, event_like: dict | object):
-    """
-    Уведомляет пользователя о том, что событие обновлено.
-    В тексте: заголовок, опционально описание, ID. Кнопка открывает webApp по public_id.
-    """
-    lang = (getattr(user, "language_code", None) or "en").lower()
-    is_ru = lang.startswith("ru")
-
-    title = (_get(event_like, "title") or "Untitled").strip()
-    description = (_get(event_like, "description") or "").strip()
-    public_id = _get(event_like, "public_id") or _get(event_like, "publicId")
-    eid = _get(event_like, "id")
-
-    header = "Событие обновлено ✏️" if is_ru else "Event updated ✏️"
-    btn_text = "Открыть событие" if is_ru else "Open event"
-    desc = f"\n{description}" if description else ""
-
-    start_url = f"{CLIENT_URL}/event/public/{public_id}"
-
-    markup = InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text=btn_text, web_app=WebAppInfo(url=start_url))
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _webapp_markup(url: str, btn_text: str) -> CachedMarkup:
+    # Один экземпляр на (url, текст кнопки); после создания разметку не меняем
+    return CachedMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text=btn_text, web_app=WebAppInfo(url=url))
     ]])
 
-    text = f"<b>{header}</b>\n\n<b>{title}</b>{desc}\nID: {eid}"
 
+def _format_dt(dt) -> str:
+    # dt: datetime из БД (обычно naive/UTC) или ISO-строка из payload. Для простоты — YYYY-MM-DD HH:MM.
     try:
-        await telegram_bot.bot.send_message(
-            chat_id=getattr(user, "id"),
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_event_updated_pm] Failed to send PM: {e}")
-
-
-async def _send_event_updated_to_participant_lang(tg_id: int, lang: str | None, event_like):
-    ru = _is_ru(lang)
-    title = (_get(event_like, "title") or "Untitled").strip()
-    public_id = _get(event_like, "public_id") or _get(event_like, "publicId")
-    eid = _get(event_like, "id")
-
-    header = "Событие обновлено ✏️" if ru else "Event updated ✏️"
-    btn = "Открыть событие" if ru else "Open event"
-
-    url = await _build_event_startapp_url(public_id)
-    markup = _webapp_markup(url, btn)
+        if isinstance(dt, str):
+            dt = datetime.fromisoformat(dt)
+        return dt.strftime("%Y-%m-%d %H:%M")
+    except Exception as ex:
+        print(ex)
+        return str(dt)
 
-    text = f"<b>{header}</b>\n\n«{title}»\nID: {eid}" if ru else f"<b>{header}</b>\n\n“{title}”\nID: {eid}"
 
+def _format_slot(slot_start, tz_name: str | None) -> str:
+    # время слота в таймзоне события; если таймзона неизвестна — как есть (UTC)
     try:
-        await telegram_bot.bot.send_message(
-            chat_id=tg_id,
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[_send_event_updated_to_participant_lang] Failed: {e}")
-
-
-async def notify_event_updated_participants_from_full(
-    full_event_response,           # EventFullResponse
-    actor_telegram_user_id: int,   # кто сделал апдейт — исключаем из рассылки
-):
-    """
-    Рассылает уведомления всем участникам события (из .participants),
-    используя их персональные language_code.
-    """
-    if not full_event_response:
-        return
-
-    event_like = _get(full_event_response, "event")
-    participants = _get(full_event_response, "participants") or []
-
-    tasks = []
-    seen = set()  # на случай дублей
-
-    for p in participants:
-        tg_id = _get(p, "telegram_user_id")
-        if not tg_id or tg_id == actor_telegram_user_id or tg_id in seen:
-            continue
-        seen.add(tg_id)
-
-        lang = _get(p, "language_code") or "en"
-        tasks.append(_send_event_updated_to_participant_lang(tg_id, lang, event_like))
-
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
-
-
-def _user_full_name(u) -> str:
-    first = getattr(u, "first_name", None) or ""
-    last = getattr(u, "last_name", None) or ""
-    return " ".join([p for p in (first.strip(), last.strip()) if p]).strip() or "Unknown"
+        dt = datetime.fromisoformat(slot_start) if isinstance(slot_start, str) else slot_start
+        if tz_name:
+            dt = dt.astimezone(get_zone(tz_name))
+        return dt.strftime("%d.%m %H:%M")
+    except Exception:
+        return _format_dt(slot_start)
 
 
-def _user_at(u) -> str:
-    username = getattr(u, "username", None)
-    return f"@{username}" if username else ""
+# --- поля шаблонов по kind ---
 
+def _event_created_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    description = (event.get("description") or "").strip()
+    return {"title": _title(event), "description": description or t.extra["no_description"]}
 
-async def _build_event_startapp_url(public_id: str | None) -> str:
-    try:
-        return f"{CLIENT_URL}/event/public/{public_id}" if public_id else f"{CLIENT_URL}/"
-    except Exception:
-        return f"{CLIENT_URL}/"
 
+def _event_updated_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    description = (event.get("description") or "").strip()
+    return {"title": _title(event), "description": f"\n{description}" if description else "", "id": event.get("id")}
 
-def _webapp_markup(url: str, btn_text: str) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[[
-        InlineKeyboardButton(text=btn_text, web_app=WebAppInfo(url=url))
-    ]])
 
+def _event_id_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    return {"title": _title(event), "id": event.get("id")}
 
-async def send_creator_vote_notification_from_result(
-    submit_result: Dict[str, Any],
-    voter_user,  # telegram_data.user
-):
-    """
-    Уведомление создателю: "В событии ... новый ответ от Имя Фамилия | @username" + кнопка на событие.
-    Все данные берутся из submit_result (event, creator_telegram_user_id, creator_language_code).
-    """
-    event = submit_result.get("event") or {}
-    creator_telegram_user_id = submit_result.get("creator_telegram_user_id")
-    creator_lang = submit_result.get("creator_language_code") or "en"
 
-    if not creator_telegram_user_id:
-        return  # нечего слать
+def _title_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    return {"title": _title(event)}
 
-    ru = _is_ru(creator_lang)
-    title = (event.get("title") or "Untitled").strip()
-    public_id = event.get("public_id")
 
-    full = _user_full_name(voter_user)
-    at = _user_at(voter_user)
-    sep = " | " if at else ""
+def _vote_creator_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    return {"title": _title(event), "voter": _user_label(payload.get("voter") or {})}
 
-    header = "Новый ответ по событию" if ru else "New response on event"
-    btn = "Открыть событие" if ru else "Open event"
 
-    url = await _build_event_startapp_url(public_id)
-    markup = _webapp_markup(url, btn)
+def _vote_digest_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    """Сводка создателю: кто проголосовал за окно и текущие итоги по слотам"""
+    voters = list((payload.get("voters") or {}).values())
+    names = [_user_label(v) for v in voters[:DIGEST_MAX_VOTERS]]
+    if len(voters) > len(names):
+        names.append(t.extra["more"].format(count=len(voters) - len(names)))
 
-    # Пример: В событии «Название» новый ответ от Имя Фамилия | @username
-    if ru:
-        text = f"<b>{header}</b>\n\n«{title}»\nОт: {full}{sep}{at}"
-    else:
-        text = f"<b>{header}</b>\n\n“{title}”\nFrom: {full}{sep}{at}"
+    tallies = [x for x in payload.get("tallies") or [] if x.get("votes")][:DIGEST_MAX_SLOTS]
+    tallies_text = ""
+    if tallies:
+        lines = [f"{_format_slot(x.get('slot_start'), event.get('timezone'))} — {x['votes']}" for x in tallies]
+        tallies_text = "\n\n" + t.extra["tallies"] + "\n" + "\n".join(lines)
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=creator_telegram_user_id,
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_creator_vote_notification_from_result] Failed: {e}")
-
-
-async def send_voter_vote_notification_from_result(
-    submit_result: Dict[str, Any],
-    voter_user,
-):
-    """
-    Уведомление участнику: "Вы оставили ответ на событие ..." + кнопка на событие.
-    Язык берём из voter_user.language_code.
-    """
-    event = submit_result.get("event") or {}
-    lang = getattr(voter_user, "language_code", None) or "en"
-    ru = _is_ru(lang)
-
-    title = (event.get("title") or "Untitled").strip()
-    public_id = event.get("public_id")
-
-    header = "Вы оставили ответ на событие" if ru else "You submitted your response for"
-    btn = "Открыть событие" if ru else "Open event"
-
-    url = await _build_event_startapp_url(public_id)
-    markup = _webapp_markup(url, btn)
-
-    text = f"<b>{header}</b>\n\n«{title}»" if ru else f"<b>{header}</b>\n\n“{title}”"
+    header = t.extra["header_one"] if len(voters) == 1 else t.extra["header_many"].format(count=len(voters))
+    return {"header": header, "title": _title(event), "voters": ", ".join(names), "tallies": tallies_text}
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=getattr(voter_user, "id"),
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_voter_vote_notification_from_result] Failed: {e}")
-
-
-async def notify_about_new_votes_from_submit_result(
-    submit_result: Dict[str, Any],
-    voter_user,
-):
-    """
-    Оркестратор: шлём оба уведомления на основе результата submit_votes_db.
-    """
-    creator_telegram_user_id = submit_result.get("creator_telegram_user_id")
-    voter_telegram_user_id = getattr(voter_user, "id", None)
-
-    tasks = []
-    if creator_telegram_user_id and creator_telegram_user_id != voter_telegram_user_id:
-        tasks.append(send_creator_vote_notification_from_result(submit_result, voter_user))
-    tasks.append(send_voter_vote_notification_from_result(submit_result, voter_user))
-
-    # Можно await для гарантии, либо запустить в фоне через create_task в месте вызова.
-    for t in tasks:
-        try:
-            await t
-        except Exception as e:
-            print(f"[notify_about_new_votes_from_submit_result] Task failed: {e}")
 
+def _event_finalized_fields(event: Dict[str, Any], payload: Dict[str, Any], t: Template) -> Dict[str, Any]:
+    return {"title": _title(event), "slot": _format_dt((payload.get("final_slot") or {}).get("slot_start"))}
 
-def _format_dt(dt) -> str:
-    # dt: datetime из БД (обычно naive/UTC). Для простоты — YYYY-MM-DD HH:MM.
-    try:
-        return dt.strftime("%Y-%m-%d %H:%M")
-    except Exception as ex:
-        print(ex)
-        return str(dt)
 
+FieldBuilder = Callable[[Dict[str, Any], Dict[str, Any], Template], Dict[str, Any]]
 
-async def send_finalized_creator_notification(finalize_result: Dict[str, Any]):
-    event = finalize_result["event"]
-    final_slot = finalize_result["final_slot"]
-    creator = finalize_result["creator"]
+FIELD_BUILDERS: Dict[str, FieldBuilder] = {
+    "event_created": _event_created_fields,
+    "event_deleted": _event_id_fields,
+    "event_updated": _event_updated_fields,
+    "event_updated_participant": _event_id_fields,
+    "vote_creator": _vote_creator_fields,  # строки, поставленные до появления сводок
+    "vote_digest": _vote_digest_fields,
+    "vote_voter": _title_fields,
+    "event_finalized": _event_finalized_fields,
+    "event_restored": _title_fields,
+}
 
-    ru = _is_ru(creator.get("language_code"))
-    title = (event.get("title") or "Untitled").strip()
-    slot_str = _format_dt(final_slot.get("slot_start"))
-    btn = "Открыть событие" if ru else "Open event"
 
-    url = await _build_event_startapp_url(event.get("public_id"))
-    markup = _webapp_markup(url, btn)
+def render_notification(kind: str, lang: str | None, payload: Dict[str, Any]) -> Mapping[str, Any]:
+    """Аргументы send_message (без chat_id) для строки outbox"""
+    template_kind = TEMPLATE_ALIASES.get(kind, kind)
+    template = TEMPLATES.get((template_kind, _lang_key(lang)))
+    if template is None:
+        raise ValueError(f"Unknown notification kind: {kind}")
 
-    if ru:
-        text = f"<b>Событие завершено</b>\n\n«{title}»\nФинальный слот: {slot_str}"
-    else:
-        text = f"<b>Event finalized</b>\n\n“{title}”\nFinal slot: {slot_str}"
+    event = payload.get("event") or {}
+    message = {
+        "text": template.text.format(**FIELD_BUILDERS[template_kind](event, payload, template)),
+        "parse_mode": "HTML",
+        "disable_web_page_preview": True,
+    }
+    if template.button is not None:
+        message["reply_markup"] = _webapp_markup(_event_url(event.get("public_id")), template.button)
+    # из кеша одно и то же сообщение уходит всем получателям — только для чтения
+    return MappingProxyType(message)
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=creator["telegram_user_id"],
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_finalized_creator_notification] Failed: {e}")
-
-
-async def send_finalized_participant_notification(user_tg_id: int, lang: str, event: Dict[str, Any], final_slot: Dict[str, Any]):
-    ru = _is_ru(lang)
-    title = (event.get("title") or "Untitled").strip()
-    slot_str = _format_dt(final_slot.get("slot_start"))
-    btn = "Открыть событие" if ru else "Open event"
-
-    url = await _build_event_startapp_url(event.get("public_id"))
-    markup = _webapp_markup(url, btn)
-
-    if ru:
-        text = f"<b>Событие завершено</b>\n\n«{title}»\nФинальный слот: {slot_str}"
-    else:
-        text = f"<b>Event finalized</b>\n\n“{title}”\nFinal slot: {slot_str}"
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=user_tg_id,
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_finalized_participant_notification] Failed: {e}")
-
-
-async def notify_event_finalized(finalize_result: Dict[str, Any]):
-    """
-    Отправляет:
-    - создателю: подтверждение о завершении, финальный слот, кнопка на событие
-    - всем проголосовавшим: уведомление о завершении, финальный слот, кнопка на событие
-    Создателя из рассылки по участникам исключаем.
-    """
-    event = finalize_result["event"]
-    final_slot = finalize_result["final_slot"]
-    creator = finalize_result["creator"]
-    participants = finalize_result.get("participants", [])
-
-    # сообщение создателю
-    await send_finalized_creator_notification(finalize_result)
-
-    # рассылка участникам
-    creator_tg_id = creator.get("telegram_user_id")
-    tasks = []
-    for p in participants:
-        p_tg = p["telegram_user_id"]
-        if not p_tg or p_tg == creator_tg_id:
-            continue
-        tasks.append(
-            send_finalized_participant_notification(
-                p_tg,
-                p.get("language_code") or "en",
-                event,
-                final_slot
-            )
-        )
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
-
-
-async def send_restored_creator_notification(restore_result: Dict[str, Any]):
-    event = restore_result["event"]
-    creator = restore_result["creator"]
-
-    ru = _is_ru(creator.get("language_code"))
-    title = (event.get("title") or "Untitled").strip()
-    btn = "Открыть событие" if ru else "Open event"
-    url = await _build_event_startapp_url(event.get("public_id"))
-    markup = _webapp_markup(url, btn)
-
-    text = (
-        f"<b>Событие восстановлено</b>\n\n«{title}»\nСобытие снова доступно."
-        if ru else
-        f"<b>Event restored</b>\n\n“{title}”\nThe event is available again."
-    )
+@lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_cached(kind: str, lang_key: str, raw_payload: str) -> Mapping[str, Any]:
+    return render_notification(kind, lang_key, loads(raw_payload))
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=creator["telegram_user_id"],
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_restored_creator_notification] Failed: {e}")
-
-
-async def send_restored_participant_notification(user_tg_id: int, lang: str, event: Dict[str, Any]):
-    ru = _is_ru(lang)
-    title = (event.get("title") or "Untitled").strip()
-    btn = "Открыть событие" if ru else "Open event"
-    url = await _build_event_startapp_url(event.get("public_id"))
-    markup = _webapp_markup(url, btn)
-
-    text = (
-        f"<b>Событие восстановлено</b>\n\n«{title}»\nСобытие снова доступно."
-        if ru else
-        f"<b>Event restored</b>\n\n“{title}”\nThe event is available again."
-    )
 
-    try:
-        await telegram_bot.bot.send_message(
-            chat_id=user_tg_id,
-            text=text,
-            reply_markup=markup,
-            parse_mode="HTML",
-            disable_web_page_preview=True,
-        )
-    except Exception as e:
-        print(f"[send_restored_participant_notification] Failed: {e}")
-
-
-async def notify_event_restored(restore_result: Dict[str, Any]):
-    """
-    Отправляет:
-    - создателю: уведомление о восстановлении + кнопка на событие
-    - всем проголосовавшим: уведомление о восстановлении + кнопка на событие
-    """
-    event = restore_result["event"]
-    creator = restore_result["creator"]
-    participants = restore_result.get("participants", [])
-
-    # Создателю
-    await send_restored_creator_notification(restore_result)
-
-    # Участникам (исключаем создателя)
-    creator_tg_id = creator.get("telegram_user_id")
-    tasks = []
-    for p in participants:
-        p_tg = p["telegram_user_id"]
-        if not p_tg or p_tg == creator_tg_id:
-            continue
-        tasks.append(send_restored_participant_notification(p_tg, p.get("language_code") or "en", event))
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
+def render_outbox_row(kind: str, lang: str | None, raw_payload: str) -> Mapping[str, Any]:
+    """Рендер строки outbox по сырому JSON payload: у строк одной рассылки он одинаковый"""
+    return _render_cached(kind, _lang_key(lang), raw_payload)
@@ -0,0 +1,178 @@
+"""
+HTTP-сессия бота с настроенным пулом соединений к Bot API.
+
+Стандартная AiohttpSession aiogram создаёт TCPConnector с настройками по умолчанию:
+100 соединений, keep-alive 15 с, без отдельного таймаута на connect/чтение.
+Все запросы бота идут на один хост, поэтому при пачке уведомлений важны
+лимит на хост (сколько отправок идёт параллельно) и keep-alive (чтобы после паузы
+не открывать TLS-соединения заново). Таймауты раздельные: зависший connect
+не должен ждать общий таймаут запроса.
+
+Метрики пула: занятые/свободные соединения, ожидание свободного соединения
+(очередь коннектора), время установки нового соединения (DNS + TCP + TLS),
+длительность запросов по методу Bot API.
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional, cast
+
+from aiogram import Bot, __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import InputFile
+from aiohttp import ClientError, ClientSession, ClientTimeout, FormData, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+from bot_notifications import CachedMarkup
+from codec import loads
+from config import (BOT_HTTP_CONNECT_TIMEOUT, BOT_HTTP_DNS_TTL, BOT_HTTP_KEEPALIVE, BOT_HTTP_POOL_PER_HOST,
+                    BOT_HTTP_POOL_SIZE, BOT_HTTP_READ_TIMEOUT, BOT_HTTP_TIMEOUT)
+from metrics import Counter, Gauge, Histogram, add_collector
+
+# Ожидание соединения и connect обычно миллисекунды, но на холодном старте TLS — сотни мс
+POOL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+BOT_HTTP_CONNECTIONS = Gauge("bot_http_connections", "Connections in the Bot API connection pool", ("state",))
+BOT_HTTP_CONNECTIONS_OPENED = Counter("bot_http_connections_acquired_total",
+                                      "Bot API connections taken from the pool", ("kind",))
+BOT_HTTP_POOL_WAIT = Histogram("bot_http_pool_wait_seconds",
+                               "Time spent waiting for a free Bot API connection", buckets=POOL_BUCKETS)
+BOT_HTTP_CONNECT = Histogram("bot_http_connect_seconds",
+                             "Time to open a new Bot API connection (DNS, TCP, TLS)", buckets=POOL_BUCKETS)
+BOT_HTTP_REQUEST = Histogram("bot_http_request_seconds", "Bot API request latency", ("method", "outcome"))
+
+
+async def _on_queued_start(session, ctx, params):
+    ctx.queued_at = time.perf_counter()
+
+
+async def _on_queued_end(session, ctx, params):
+    BOT_HTTP_POOL_WAIT.observe(time.perf_counter() - ctx.queued_at)
+
+
+async def _on_create_start(session, ctx, params):
+    ctx.connect_at = time.perf_counter()
+
+
+async def _on_create_end(session, ctx, params):
+    BOT_HTTP_CONNECT.observe(time.perf_counter() - ctx.connect_at)
+    BOT_HTTP_CONNECTIONS_OPENED.inc("new")
+
+
+async def _on_reuse(session, ctx, params):
+    BOT_HTTP_CONNECTIONS_OPENED.inc("reused")
+
+
+def _trace_config() -> TraceConfig:
+    trace = TraceConfig(trace_config_ctx_factory=SimpleNamespace)
+    trace.on_connection_queued_start.append(_on_queued_start)
+    trace.on_connection_queued_end.append(_on_queued_end)
+    trace.on_connection_create_start.append(_on_create_start)
+    trace.on_connection_create_end.append(_on_create_end)
+    trace.on_connection_reuseconn.append(_on_reuse)
+    return trace
+
+
+class BotSession(AiohttpSession):
+    def __init__(self, pool_size: int = BOT_HTTP_POOL_SIZE, pool_per_host: int = BOT_HTTP_POOL_PER_HOST,
+                 keepalive: float = BOT_HTTP_KEEPALIVE, dns_ttl: int = BOT_HTTP_DNS_TTL,
+                 connect_timeout: float = BOT_HTTP_CONNECT_TIMEOUT, read_timeout: float = BOT_HTTP_READ_TIMEOUT,
+                 timeout: float = BOT_HTTP_TIMEOUT, **kwargs):
+        # ответы Bot API разбираем orjson (codec.loads), как и всё остальное в сервере
+        kwargs.setdefault("json_loads", loads)
+        super().__init__(timeout=timeout, **kwargs)
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_per_host,
+            keepalive_timeout=keepalive,
+            use_dns_cache=dns_ttl > 0,
+            ttl_dns_cache=dns_ttl or None,
+        )
+        self._client_timeout = ClientTimeout(total=timeout, connect=connect_timeout, sock_read=read_timeout)
+        add_collector(self._collect_pool_metrics)
+
+    def _collect_pool_metrics(self):
+        if self._session is None or self._session.closed:
+            return
+        connector = self._session.connector
+        # у TCPConnector нет публичного API для размера пула — читаем его внутренние структуры
+        busy = len(getattr(connector, "_acquired", ()))
+        idle = sum(len(conns) for conns in getattr(connector, "_conns", {}).values())
+        BOT_HTTP_CONNECTIONS.set("busy", value=busy)
+        BOT_HTTP_CONNECTIONS.set("idle", value=idle)
+        BOT_HTTP_CONNECTIONS.set("max", value=connector.limit)
+
+    async def create_session(self) -> ClientSession:
+        # как AiohttpSession.create_session, но с таймаутами и трассировкой пула
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={
+                    USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}",
+                },
+                timeout=self._client_timeout,
+                trace_configs=[_trace_config()],
+            )
+            self._should_reset_connector = False
+
+        return self._session
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[TelegramType]) -> FormData:
+        # как AiohttpSession.build_form_data, но разметку из кеша уведомлений сериализуем один раз:
+        # у рассылки одна и та же кнопка уходит каждому получателю
+        markup = getattr(method, "reply_markup", None)
+        if not isinstance(markup, CachedMarkup):
+            return super().build_form_data(bot=bot, method=method)
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        if markup._serialized is None:
+            markup._serialized = self.prepare_value(markup.model_dump(warnings=False), bot=bot, files=files)
+        form.add_field("reply_markup", markup._serialized)
+        for key, value in files.items():
+            form.add_field(
+                key,
+                value.read(bot),
+                filename=value.filename or key,
+            )
+        return form
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[TelegramType],
+                           timeout: Optional[int] = None) -> TelegramType:
+        # как AiohttpSession.make_request, но с раздельными таймаутами и метрикой по методу
+        session = await self.create_session()
+
+        url = self.api.api_url(token=bot.token, method=method.__api_method__)
+        form = self.build_form_data(bot=bot, method=method)
+
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            async with session.post(
+                url, data=form, timeout=self._client_timeout if timeout is None else timeout
+            ) as resp:
+                raw_result = await resp.text()
+            outcome = str(resp.status)
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+            raise TelegramNetworkError(method=method, message="Request timeout error")
+        except ClientError as e:
+            raise TelegramNetworkError(method=method, message=f"{type(e).__name__}: {e}")
+        finally:
+            BOT_HTTP_REQUEST.observe(time.perf_counter() - started, method.__api_method__, outcome)
+        response = self.check_response(
+            bot=bot, method=method, status_code=resp.status, content=raw_result
+        )
+        return cast(TelegramType, response.result)
@@ -0,0 +1,107 @@
+from typing import Any, AsyncIterator, Type, TypeVar
+from uuid import UUID
+
+import orjson
+from fastapi import Request
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ValidationError
+
+from middleware import timed
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Сколько байт NDJSON копим перед отправкой очередного чанка
+NDJSON_CHUNK_SIZE = 64 * 1024
+
+
+class InvalidJSONError(ValueError):
+    """Тело запроса не является корректным JSON"""
+
+
+def _default(obj: Any) -> Any:
+    # Вложенные pydantic-модели (например, в dict-ответах) сериализуем их же сериализатором
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    # asyncpg и uuid6 отдают подклассы UUID, которые orjson сам не сериализует
+    if isinstance(obj, UUID):
+        return str(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+def loads(raw: bytes | str) -> Any:
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError as e:
+        raise InvalidJSONError(str(e)) from e
+
+
+class DefaultResponse(ORJSONResponse):
+    """Ответ по умолчанию для всего API (orjson + поддержка вложенных моделей)"""
+
+    def render(self, content: Any) -> bytes:
+        with timed("serialization"):
+            return dumps(content)
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """
+    Сразу превращает результат в байты, минуя jsonable_encoder FastAPI:
+    модели — через model_dump_json (pydantic-core), остальное — через orjson.
+    """
+    if isinstance(content, BaseModel):
+        with timed("serialization"):
+            body = content.model_dump_json()
+        return Response(body, status_code=status_code, media_type=JSON_MEDIA_TYPE)
+    return DefaultResponse(content, status_code=status_code)
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+async def _ndjson_chunks(rows: AsyncIterator[Any]) -> AsyncIterator[bytes]:
+    # Первую строку отдаём сразу (время до первого байта не зависит от размера выборки),
+    # дальше склеиваем строки в чанки, чтобы не дёргать сокет на каждую запись
+    buffer = bytearray()
+    first = True
+    async for row in rows:
+        buffer += dumps(row)
+        buffer += b"\n"
+        if first or len(buffer) >= NDJSON_CHUNK_SIZE:
+            first = False
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def ndjson_response(rows: AsyncIterator[Any], headers: dict | None = None) -> StreamingResponse:
+    return StreamingResponse(_ndjson_chunks(rows), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+
+def parse_model(model: Type[ModelT], raw: bytes | str, context: dict | None = None) -> ModelT:
+    """
+    Валидирует модель прямо из сырых байтов (без промежуточного dict).
+    Некорректный JSON отдаём отдельным исключением, ошибки полей — как ValidationError.
+    """
+    try:
+        return model.model_validate_json(raw, context=context)
+    except ValidationError as e:
+        if any(err["type"] == "json_invalid" for err in e.errors()):
+            raise InvalidJSONError("Invalid JSON format") from e
+        raise
+
+
+async def read_json(request: Request) -> Any:
+    return loads(await request.body())
+
+
+async def read_model(request: Request, model: Type[ModelT]) -> ModelT:
+    return parse_model(model, await request.body())
@@ -7,7 +7,92 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "your_webhook_secret")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH")
+# Снимать webhook при остановке процесса. По умолчанию нет: при нескольких процессах и rolling restart
+# остановка одного процесса снимала бы webhook у всего сервиса
+WEBHOOK_DELETE_ON_SHUTDOWN = os.getenv("WEBHOOK_DELETE_ON_SHUTDOWN", "false").lower() in ("1", "true", "yes")
+# Обработка webhook: воркеров (апдейты одного чата идут в один воркер по порядку), размер очереди,
+# сколько последних update_id помнить для отбрасывания повторных доставок
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DEDUPE_WINDOW = int(os.getenv("WEBHOOK_DEDUPE_WINDOW", "10000"))
+# Базовый URL Bot API (локальный Bot API сервер или bench/fake_bot_api.py); пустой — api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL")
 
 DB_URL = os.getenv("DB_URL")
 
 CLIENT_URL = os.getenv("CLIENT_URL")
+
+# Запуск через python main.py: адрес и число процессов uvicorn. При нескольких процессах разовые
+# обязанности (webhook, очистка outbox) выполняет лидер (leader.py), лимиты отправки делятся между процессами
+SERVER_HOST = os.getenv("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "80"))
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+# Бюджет холодного старта (от импорта main до приёма запросов), секунды; превышение пишется в лог.
+# Разбивка по фазам и импортам: python main.py --startup-profile (см. startup.py)
+STARTUP_BUDGET_SECONDS = float(os.getenv("STARTUP_BUDGET_SECONDS", "5"))
+# Как часто процесс пробует стать лидером, а лидер проверяет своё соединение с БД (секунды)
+LEADER_CHECK_INTERVAL = float(os.getenv("LEADER_CHECK_INTERVAL", "5"))
+
+# Запросы к БД дольше порога попадают в лог вместе с формой параметров
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+# Запросы дольше порога сохраняются с разбивкой времени (см. /admin/slow-requests)
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_REQUEST_BUFFER_SIZE = int(os.getenv("SLOW_REQUEST_BUFFER_SIZE", "200"))
+
+# Токен для служебных эндпоинтов /admin/* и /metrics (заголовок X-Admin-Token или Authorization: Bearer);
+# пустой — эндпоинты выключены
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# Лимиты отправки сообщений ботом (Telegram: ~30 сообщений/с всего и ~1 сообщение/с в один чат).
+# Лимит на чат чуть ниже секунды: из-за разброса сетевой задержки сообщения, отправленные ровно
+# через 1 с, приходят в Telegram чаще, а любой 429 приостанавливает всю отправку
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", "30"))
+NOTIFY_CHAT_RATE = float(os.getenv("NOTIFY_CHAT_RATE", "0.9"))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", "3"))
+# Сколько секунд при остановке дожидаемся отправки оставшейся очереди уведомлений
+NOTIFY_DRAIN_TIMEOUT = float(os.getenv("NOTIFY_DRAIN_TIMEOUT", "10"))
+
+# Сколько отправок диспетчер держит в полёте одновременно (при медленном Telegram остальные ждут)
+NOTIFY_MAX_IN_FLIGHT = int(os.getenv("NOTIFY_MAX_IN_FLIGHT", "64"))
+
+# Сколько секунд при остановке дожидаемся принятых апдейтов (update_queue) до закрытия пула БД
+BACKGROUND_DRAIN_TIMEOUT = float(os.getenv("BACKGROUND_DRAIN_TIMEOUT", "10"))
+
+# Очередь уведомлений notification_outbox (см. outbox.py)
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "2"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+# Сколько секунд строка закреплена за воркером; после падения процесса её подхватит другой
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# Сколько часов хранить отправленные строки (dead letter не удаляются)
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "24"))
+
+# Голоса за одно событие, пришедшие в пределах окна, уходят создателю одной сводкой
+VOTE_DIGEST_WINDOW_SECONDS = float(os.getenv("VOTE_DIGEST_WINDOW_SECONDS", "30"))
+
+# HTTP-пул бота к Bot API (см. bot_session.py): всего соединений, на один хост (все запросы идут на один),
+# сколько секунд держать свободное соединение открытым, TTL кеша DNS (0 — без кеша)
+BOT_HTTP_POOL_SIZE = int(os.getenv("BOT_HTTP_POOL_SIZE", "100"))
+BOT_HTTP_POOL_PER_HOST = int(os.getenv("BOT_HTTP_POOL_PER_HOST", "50"))
+BOT_HTTP_KEEPALIVE = float(os.getenv("BOT_HTTP_KEEPALIVE", "60"))
+BOT_HTTP_DNS_TTL = int(os.getenv("BOT_HTTP_DNS_TTL", "300"))
+# Таймауты запроса к Bot API: установка соединения, ожидание данных от сервера, весь запрос
+BOT_HTTP_CONNECT_TIMEOUT = float(os.getenv("BOT_HTTP_CONNECT_TIMEOUT", "5"))
+BOT_HTTP_READ_TIMEOUT = float(os.getenv("BOT_HTTP_READ_TIMEOUT", "30"))
+BOT_HTTP_TIMEOUT = float(os.getenv("BOT_HTTP_TIMEOUT", "60"))
+
+# Сжатие ответов JSON и .ics (middleware.CompressionMiddleware): не меньше COMPRESS_MIN_SIZE байт,
+# уровни gzip и brotli (ограничены сверху в middleware); тела от COMPRESS_THREAD_MIN_SIZE байт
+# сжимаются в потоке, чтобы не держать event loop
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+COMPRESS_THREAD_MIN_SIZE = int(os.getenv("COMPRESS_THREAD_MIN_SIZE", "65536"))
+
+# Готовые .ics в памяти: сколько календарей держим и сколько секунд живёт запись
+ICS_CACHE_SIZE = int(os.getenv("ICS_CACHE_SIZE", "1000"))
+ICS_CACHE_TTL = float(os.getenv("ICS_CACHE_TTL", "3600"))
+# Каталог для календарей /api/generate-ics: общий для всех процессов (WEB_WORKERS), файлы живут ICS_CACHE_TTL
+ICS_DIR = os.getenv("ICS_DIR", "temp/ics")
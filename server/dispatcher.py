@@ -0,0 +1,255 @@
+"""
+Отправка сообщений бота с учётом лимитов Telegram.
+
+Telegram пропускает около 30 сообщений/с на бота и около 1 сообщения/с в один чат,
+сверх этого отвечает 429 (TelegramRetryAfter). Все уведомления ставятся в очередь
+диспетчера, который:
+- держит общий и поканальный token bucket;
+- выбирает задания по приоритету: личные подтверждения раньше массовых рассылок;
+- на RetryAfter приостанавливает отправку на указанное Telegram время и повторяет сообщение.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+
+from config import NOTIFY_CHAT_RATE, NOTIFY_DRAIN_TIMEOUT, NOTIFY_GLOBAL_RATE, NOTIFY_MAX_IN_FLIGHT, NOTIFY_MAX_RETRIES, \
+    WEB_WORKERS
+from metrics import Counter, Gauge
+from tasks import TaskSupervisor
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты (меньше — раньше)
+PRIORITY_DIRECT = 0  # ответ пользователю на его действие
+PRIORITY_BULK = 1    # рассылка участникам события
+LANE_NAMES = ("direct", "bulk")
+
+# Сколько заданий с начала очереди просматриваем в поисках чата, в который уже можно писать
+SCAN_LIMIT = 256
+# Поканальные bucket'ы, простаивающие дольше, выкидываем
+CHAT_BUCKET_IDLE_SECONDS = 60
+
+NOTIFY_SENT = Counter("notify_sent_total", "Messages delivered to Telegram", ("lane",))
+NOTIFY_FAILED = Counter("notify_failed_total", "Messages dropped after an error", ("lane", "error"))
+NOTIFY_RETRY_AFTER = Counter("notify_retry_after_total", "429 RetryAfter responses from Telegram")
+NOTIFY_QUEUE_DEPTH = Gauge("notify_queue_depth", "Messages waiting in the dispatcher", ("lane",))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 — уже есть)"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Job:
+    __slots__ = ("chat_id", "kwargs", "lane", "future", "attempts")
+
+    def __init__(self, chat_id: int, kwargs: Dict[str, Any], lane: int, future: asyncio.Future):
+        self.chat_id = chat_id
+        self.kwargs = kwargs
+        self.lane = lane
+        self.future = future
+        self.attempts = 0
+
+
+def _default_send(**kwargs) -> Awaitable[Any]:
+    from bot import telegram_bot
+    return telegram_bot.bot.send_message(**kwargs)
+
+
+class SendDispatcher:
+    def __init__(self, send: Callable[..., Awaitable[Any]] = _default_send,
+                 global_rate: float = NOTIFY_GLOBAL_RATE, chat_rate: float = NOTIFY_CHAT_RATE,
+                 max_retries: int = NOTIFY_MAX_RETRIES, max_in_flight: int = NOTIFY_MAX_IN_FLIGHT):
+        self._send = send
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self._lanes: List[Deque[_Job]] = [deque() for _ in LANE_NAMES]
+        self._global: Optional[TokenBucket] = None
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        # сами отправки; когда все слоты заняты, планировщик ждёт (не плодит корутины)
+        self._sends = TaskSupervisor("notify-send", concurrency=max_in_flight, queue_size=max_in_flight)
+
+    # --- публичный API ---
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run(), name="notify-dispatcher")
+            self._sends.start()
+
+    async def stop(self, timeout: float = NOTIFY_DRAIN_TIMEOUT) -> None:
+        """Дожидается отправки очереди (не дольше timeout), остаток отменяет"""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.pending() or self._sends.busy()) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        dropped = 0
+        for _fn, (job,), _kwargs in await self._sends.drain(max(0.0, deadline - time.monotonic())):
+            job.future.cancel()
+            dropped += 1
+        for lane in self._lanes:
+            while lane:
+                job = lane.popleft()
+                if not job.future.done():
+                    job.future.cancel()
+                dropped += 1
+        self._update_depth()
+        if dropped:
+            logger.warning(f"Notification dispatcher stopped with {dropped} unsent messages")
+
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    def send_message(self, chat_id: int, priority: int = PRIORITY_BULK, **kwargs) -> asyncio.Future:
+        """
+        Ставит send_message в очередь. Возвращает future с результатом отправки
+        (или исключением Telegram, если сообщение так и не ушло).
+        """
+        self.start()  # ленивый старт, если диспетчер не запущен в lifespan
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[priority].append(_Job(chat_id, {"chat_id": chat_id, **kwargs}, priority, future))
+        self._update_depth()
+        self._wakeup.set()
+        return future
+
+    # --- планировщик ---
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, 1, now)
+        return bucket
+
+    def _pick(self, now: float):
+        """Первое по приоритету задание, чат которого готов; иначе — сколько ждать"""
+        wait = None
+        for lane in self._lanes:
+            for index, job in enumerate(lane):
+                if index >= SCAN_LIMIT:
+                    break
+                chat_wait = self._chat_bucket(job.chat_id, now).wait_time(now)
+                if chat_wait == 0:
+                    del lane[index]
+                    return job, 0.0
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+        return None, wait
+
+    def _prune_chats(self, now: float) -> None:
+        idle = [c for c, b in self._chats.items() if now - b.updated > CHAT_BUCKET_IDLE_SECONDS]
+        for chat_id in idle:
+            del self._chats[chat_id]
+
+    def _update_depth(self) -> None:
+        for name, lane in zip(LANE_NAMES, self._lanes):
+            NOTIFY_QUEUE_DEPTH.set(name, value=len(lane))
+
+    async def _sleep(self, seconds: Optional[float]) -> None:
+        # новое задание может оказаться готовым раньше, поэтому ждём и wakeup
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self) -> None:
+        # без запаса токенов: с полным bucket'ом за первую секунду уходило бы 2x лимита и Telegram отвечал 429
+        self._global = TokenBucket(self.global_rate, 1, time.monotonic())
+        last_prune = time.monotonic()
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            global_wait = self._global.wait_time(now)
+            if global_wait:
+                await asyncio.sleep(global_wait)
+                continue
+
+            job, wait = self._pick(now)
+            if job is None:
+                await self._sleep(wait)
+                continue
+
+            self._global.take(now)
+            self._chat_bucket(job.chat_id, now).take(now)
+            self._update_depth()
+            try:
+                await self._sends.put(self._deliver, job)
+            except asyncio.CancelledError:
+                # остановка, пока ждали свободный слот: задание остаётся в очереди диспетчера
+                self._lanes[job.lane].appendleft(job)
+                raise
+
+            if now - last_prune > CHAT_BUCKET_IDLE_SECONDS:
+                self._prune_chats(now)
+                last_prune = now
+
+    async def _deliver(self, job: _Job) -> None:
+        # aiogram не импортируем на уровне модуля (см. bot.py); к первой отправке он уже загружен
+        from aiogram.exceptions import TelegramRetryAfter
+        lane = LANE_NAMES[job.lane]
+        job.attempts += 1
+        try:
+            result = await self._send(**job.kwargs)
+        except asyncio.CancelledError:
+            # остановка по дедлайну посреди отправки
+            job.future.cancel()
+            raise
+        except TelegramRetryAfter as e:
+            NOTIFY_RETRY_AFTER.inc()
+            # Telegram просит подождать: останавливаем все отправки и возвращаем сообщение в начало очереди
+            self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+            if job.attempts <= self.max_retries:
+                logger.warning(f"Telegram RetryAfter {e.retry_after}s, chat {job.chat_id} requeued")
+                self._lanes[job.lane].appendleft(job)
+                self._update_depth()
+                self._wakeup.set()
+                return
+            NOTIFY_FAILED.inc(lane, type(e).__name__)
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        except Exception as e:
+            NOTIFY_FAILED.inc(lane, type(e).__name__)
+            if not job.future.done():
+                job.future.set_exception(e)
+            return
+        NOTIFY_SENT.inc(lane)
+        if not job.future.done():
+            job.future.set_result(result)
+
+
+# Лимиты Telegram общие на бота: при WEB_WORKERS процессах каждый отправляет свою долю
+dispatcher = SendDispatcher(global_rate=NOTIFY_GLOBAL_RATE / WEB_WORKERS, chat_rate=NOTIFY_CHAT_RATE / WEB_WORKERS)
@@ -0,0 +1,369 @@
+"""
+Генерация календарей .ics и их отдача из памяти.
+
+Календарь по ICSRequest детерминирован: одинаковые поля дают одинаковые байты.
+Ключ — хеш полей запроса, готовые файлы лежат в ограниченном LRU с TTL, ETag — хеш
+содержимого, поэтому повторная загрузка того же календаря отвечает 304.
+Загрузку может обслужить другой процесс (WEB_WORKERS > 1), поэтому файл ещё
+пишется в ICS_DIR; в памяти — только быстрый путь для повторных загрузок.
+
+Календарь события (/api/events/{public_id}/calendar.ics) строится из строк БД;
+его версия — updated_at события, поэтому ETag и 304 отдаются без чтения слотов.
+Лента пользователя (/calendar/{token}.ics) так же версионируется отпечатком из БД,
+генерируется потоком по курсору и кешируется по пользователю до изменения отпечатка.
+"""
+import hashlib
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+
+from config import CLIENT_URL, ICS_CACHE_SIZE, ICS_CACHE_TTL, ICS_DIR
+from metrics import Counter
+from models import ICSRequest
+
+ICS_CACHE = Counter("ics_cache_total", "In-memory ICS cache lookups", ("result",))
+
+PRODID = "-//Telegram Event//Event//EN"
+UID_DOMAIN = "telegram-event.com"
+# Starlette сам добавляет "; charset=utf-8" к text/*; с charset здесь он оказался бы в заголовке дважды
+ICS_MEDIA_TYPE = "text/calendar"
+DEFAULT_DURATION = timedelta(hours=1)
+# RFC 5545: строки длиннее 75 октетов переносятся (CRLF + пробел)
+MAX_LINE_OCTETS = 75
+# Ключ календаря в имени файла загрузки: event_<ключ>.ics
+ICS_KEY_RE = re.compile(r"[0-9a-f]{32}")
+FEED_NAME = "Telegram Event"
+# Меняется при изменении формата календаря события: иначе клиенты с прежним ETag получат 304
+EVENT_CALENDAR_FORMAT = 1
+
+
+def escape_ics_text(text: Optional[str]) -> str:
+    """Escape special characters for ICS format"""
+    if not text:
+        return ""
+    return (text.replace("\\", "\\\\")
+            .replace(",", "\\,")
+            .replace(";", "\\;")
+            .replace("\n", "\\n")
+            .replace("\r", ""))
+
+
+def _utc(dt: datetime) -> datetime:
+    # naive-время из БД (TIMESTAMP без зоны) — это UTC
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+
+def format_ics_date(dt: datetime) -> str:
+    """Format datetime for ICS (YYYYMMDDTHHMMSSZ)"""
+    return _utc(dt).strftime("%Y%m%dT%H%M%SZ")
+
+
+def fold_line(line: str) -> str:
+    data = line.encode("utf-8")
+    if len(data) <= MAX_LINE_OCTETS:
+        return line
+    parts = []
+    limit = MAX_LINE_OCTETS
+    while data:
+        cut = min(limit, len(data))
+        # не режем посередине многобайтового символа UTF-8
+        while cut < len(data) and (data[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(data[:cut].decode("utf-8"))
+        data = data[cut:]
+        limit = MAX_LINE_OCTETS - 1  # продолжение начинается с пробела
+    return "\r\n ".join(parts)
+
+
+def vevent(uid: str, dtstamp: datetime, start: datetime, end: datetime, summary: Optional[str],
+           description: Optional[str] = None, location: Optional[str] = None, url: Optional[str] = None,
+           status: str = "CONFIRMED", sequence: int = 0, alarm: bool = True) -> str:
+    """Один VEVENT (строки уже разделены CRLF, без завершающего CRLF)"""
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{uid}",
+        f"DTSTAMP:{format_ics_date(dtstamp)}",
+        f"DTSTART:{format_ics_date(start)}",
+        f"DTEND:{format_ics_date(end)}",
+        f"SUMMARY:{escape_ics_text(summary)}",
+        f"DESCRIPTION:{escape_ics_text(description)}",
+        f"LOCATION:{escape_ics_text(location)}",
+    ]
+    if url:
+        lines.append(f"URL:{url}")
+    lines += [f"STATUS:{status}", f"SEQUENCE:{sequence}"]
+    if alarm:
+        lines += ["BEGIN:VALARM", "TRIGGER:-PT15M", "ACTION:DISPLAY", "DESCRIPTION:Reminder", "END:VALARM"]
+    lines.append("END:VEVENT")
+    return "\r\n".join(fold_line(line) for line in lines)
+
+
+def calendar_header(name: Optional[str] = None) -> str:
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN", "METHOD:PUBLISH"]
+    if name:
+        lines.append(fold_line(f"X-WR-CALNAME:{escape_ics_text(name)}"))
+    return "\r\n".join(lines) + "\r\n"
+
+
+CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+
+def calendar(events: Iterable[str], name: Optional[str] = None) -> str:
+    return calendar_header(name) + "".join(e + "\r\n" for e in events) + CALENDAR_FOOTER
+
+
+def _parse_dt(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
+
+def ics_request_key(request: ICSRequest) -> str:
+    return hashlib.sha256(request.model_dump_json().encode()).hexdigest()[:32]
+
+
+def generate_ics_content(request: ICSRequest) -> str:
+    """
+    Календарь с одним событием по полям запроса.
+    UID и DTSTAMP выводятся из самих полей, поэтому результат детерминирован.
+    """
+    try:
+        start = _parse_dt(request.startDate)
+        end = _parse_dt(request.endDate) if request.endDate else start + DEFAULT_DURATION
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error parsing dates: {str(e)}")
+
+    event = vevent(
+        uid=f"{ics_request_key(request)}@{UID_DOMAIN}",
+        dtstamp=start,
+        start=start,
+        end=end,
+        summary=request.title,
+        description=request.description,
+        location=request.location,
+    )
+    return calendar([event])
+
+
+def event_calendar_etag(public_id, version: datetime) -> str:
+    """ETag календаря события по его версии — считается без генерации содержимого"""
+    raw = f"{public_id}:{_utc(version).isoformat()}:{EVENT_CALENDAR_FORMAT}"
+    return '"' + hashlib.sha256(raw.encode()).hexdigest()[:32] + '"'
+
+
+def event_vevent(row) -> str:
+    """
+    VEVENT слота по строке события (get_event_calendar_db / iter_calendar_feed_events).
+    Итоговый слот — подтверждённое событие с UID от public_id; слот-кандидат
+    незавершённого события — предварительное (TENTATIVE) со своим UID.
+    """
+    public_id = row["public_id"]
+    version = row["version"]
+    finalized = row["final_slot_id"] is not None
+    start = row["slot_start"]
+    return vevent(
+        uid=f"{public_id}@{UID_DOMAIN}" if finalized else f"{public_id}-{row['slot_id']}@{UID_DOMAIN}",
+        dtstamp=version,
+        start=start,
+        end=start + DEFAULT_DURATION,
+        summary=row["title"],
+        description=row["description"],
+        location=row["location"],
+        url=f"{CLIENT_URL}/event/public/{public_id}" if CLIENT_URL else None,
+        status="CONFIRMED" if finalized else "TENTATIVE",
+        # SEQUENCE растёт с каждым изменением события
+        sequence=max(0, int((_utc(version) - _utc(row["created_at"])).total_seconds())),
+        alarm=finalized,
+    )
+
+
+def event_calendar(rows: List) -> str:
+    """Календарь события по строкам get_event_calendar_db"""
+    return calendar((event_vevent(row) for row in rows if row["slot_id"] is not None), name=rows[0]["title"])
+
+
+def feed_etag(fingerprint: str) -> str:
+    return '"' + hashlib.sha256(f"feed:{fingerprint}:{EVENT_CALENDAR_FORMAT}".encode()).hexdigest()[:32] + '"'
+
+
+async def stream_calendar(rows: AsyncIterator, key: str, etag: str, name: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Отдаёт календарь по частям, по VEVENT на строку курсора, и копит байты:
+    дочитанный до конца календарь кладётся в кеш под key с этим etag.
+    """
+    chunks: List[bytes] = []
+    chunk = calendar_header(name).encode("utf-8")
+    chunks.append(chunk)
+    yield chunk
+    async for row in rows:
+        chunk = (event_vevent(row) + "\r\n").encode("utf-8")
+        chunks.append(chunk)
+        yield chunk
+    chunk = CALENDAR_FOOTER.encode("utf-8")
+    chunks.append(chunk)
+    yield chunk
+    ics_cache.put(key, b"".join(chunks), etag)
+
+
+def etag_for(content: bytes) -> str:
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # слабое сравнение (RFC 9110, 13.1.2): W/ не учитываем
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return etag in tags
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """У клиента та же версия (If-None-Match, а без него — If-Modified-Since)"""
+    if "if-none-match" in request.headers:
+        return etag_matches(request.headers["if-none-match"], etag)
+    return not_modified_since(request.headers.get("if-modified-since"), last_modified)
+
+
+def _cache_headers(etag: str, last_modified: Optional[datetime], cache_control: str) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_http_date(last_modified)
+    return headers
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime] = None,
+                          cache_control: str = "private, no-cache") -> Response:
+    return Response(status_code=304, headers=_cache_headers(etag, last_modified, cache_control))
+
+
+def calendar_response(request: Request, content: bytes, etag: str, filename: Optional[str] = None,
+                      last_modified: Optional[datetime] = None, cache_control: str = "private, no-cache") -> Response:
+    """Ответ с календарём или 304, если у клиента та же версия (If-None-Match / If-Modified-Since)"""
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified, cache_control)
+    headers = _cache_headers(etag, last_modified, cache_control)
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return Response(content=content, media_type=ICS_MEDIA_TYPE, headers=headers)
+
+
+def calendar_stream_response(chunks: AsyncIterator[bytes], etag: str, last_modified: Optional[datetime] = None,
+                             cache_control: str = "private, no-cache") -> StreamingResponse:
+    return StreamingResponse(chunks, media_type=ICS_MEDIA_TYPE, headers=_cache_headers(etag, last_modified, cache_control))
+
+
+def format_http_date(dt: datetime) -> str:
+    return _utc(dt).strftime("%a, %d %b %Y %H:%M:%S GMT")
+
+
+def not_modified_since(if_modified_since: Optional[str], last_modified: Optional[datetime]) -> bool:
+    if not if_modified_since or last_modified is None:
+        return False
+    try:
+        since = datetime.strptime(if_modified_since, "%a, %d %b %Y %H:%M:%S GMT").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return False
+    # в HTTP-дате нет долей секунды
+    return _utc(last_modified).replace(microsecond=0) <= since
+
+
+class ICSCache:
+    """LRU на max_entries элементов; запись живёт ttl секунд с момента сохранения"""
+
+    def __init__(self, max_entries: int = ICS_CACHE_SIZE, ttl: float = ICS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+
+    def get(self, key: str, etag: Optional[str] = None) -> Optional[Tuple[bytes, str]]:
+        """etag — нужная версия: запись с другим ETag считается устаревшей"""
+        item = self._items.get(key)
+        if item is None:
+            ICS_CACHE.inc("miss")
+            return None
+        expires_at, content, cached_etag = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            ICS_CACHE.inc("expired")
+            return None
+        if etag is not None and cached_etag != etag:
+            ICS_CACHE.inc("stale")
+            return None
+        self._items.move_to_end(key)
+        ICS_CACHE.inc("hit")
+        return content, cached_etag
+
+    def put(self, key: str, content: bytes, etag: Optional[str] = None) -> str:
+        """etag по умолчанию — хеш содержимого"""
+        etag = etag or etag_for(content)
+        self._items[key] = (time.monotonic() + self.ttl, content, etag)
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+        return etag
+
+    def purge_expired(self) -> int:
+        now = time.monotonic()
+        expired: List[str] = [key for key, (expires_at, _, _) in self._items.items() if expires_at < now]
+        for key in expired:
+            del self._items[key]
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+ics_cache = ICSCache()
+
+
+def _generated_path(key: str) -> Path:
+    return Path(ICS_DIR) / f"event_{key}.ics"
+
+
+def save_generated(key: str, content: bytes) -> None:
+    """Календарь /api/generate-ics: в кеш этого процесса и в ICS_DIR для остальных"""
+    ics_cache.put(key, content)
+    path = _generated_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # пишем во временный файл и переименовываем: читатель в другом процессе не увидит половину файла
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp.write_bytes(content)
+    os.replace(tmp, path)
+
+
+def load_generated(key: str) -> Optional[Tuple[bytes, str]]:
+    """Календарь по ключу загрузки: из памяти, а если его сохранил другой процесс — из ICS_DIR"""
+    cached = ics_cache.get(key)
+    if cached is not None:
+        return cached
+    path = _generated_path(key)
+    try:
+        if path.stat().st_mtime + ics_cache.ttl < time.time():
+            return None
+        content = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    return content, ics_cache.put(key, content)
+
+
+def purge_generated() -> int:
+    """Удаляет из памяти и из ICS_DIR календари старше ICS_CACHE_TTL; возвращает число удалённых файлов"""
+    ics_cache.purge_expired()
+    cleaned = 0
+    deadline = time.time() - ics_cache.ttl
+    for path in Path(ICS_DIR).glob("event_*.ics*"):
+        try:
+            if path.stat().st_mtime < deadline:
+                path.unlink()
+                cleaned += 1
+        except FileNotFoundError:
+            pass
+    return cleaned
@@ -0,0 +1,111 @@
+"""
+Выбор лидера среди процессов сервиса через advisory lock PostgreSQL.
+
+При запуске в несколько процессов (WEB_WORKERS > 1) разовые обязанности — регистрацию
+webhook, очистку outbox — должен выполнять ровно один процесс:
+- каждый процесс держит отдельное соединение и раз в LEADER_CHECK_INTERVAL пробует
+  pg_try_advisory_lock; взявший блокировку запускает обязанности;
+- блокировка сессионная: упал процесс или оборвалось соединение — PostgreSQL освобождает её сам,
+  и на следующей попытке лидером становится другой процесс;
+- лидер проверяет своё соединение тем же интервалом и при ошибке снимает обязанности.
+Миграции сериализуются отдельной блокировкой в db.migrate(): их дожидаются все процессы.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import asyncpg
+
+from config import DB_URL, LEADER_CHECK_INTERVAL
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+LEADER = Gauge("leader", "1 if this process holds the leader lock", ("name",))
+
+# Ключ advisory lock лидера; одинаковый у всех процессов, работающих с этой БД
+LEADER_LOCK_KEY = 7345001
+
+
+class LeaderElection:
+    def __init__(self, name: str = "main", key: int = LEADER_LOCK_KEY, interval: float = LEADER_CHECK_INTERVAL):
+        self.name = name
+        self.key = key
+        self.interval = interval
+        self.is_leader = False
+        self._duties: List[Tuple[str, Callable[[], Awaitable[None]]]] = []
+        self._duty_tasks: List[asyncio.Task] = []
+        self._conn: Optional[asyncpg.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def duty(self, name: str, fn: Callable[[], Awaitable[None]]) -> None:
+        """fn запускается задачей, когда процесс становится лидером, и отменяется, когда перестаёт"""
+        self._duties.append((name, fn))
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"leader-{self.name}")
+
+    async def stop(self) -> None:
+        """Снимает обязанности и отпускает блокировку — лидером станет другой процесс"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._resign()
+        await self._disconnect()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    await self._resign()
+                    self._conn = await asyncpg.connect(DB_URL)
+                if not self.is_leader:
+                    if await self._conn.fetchval("SELECT pg_try_advisory_lock($1)", self.key):
+                        self._elect()
+                else:
+                    # блокировка живёт, пока живо соединение
+                    await self._conn.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Leader election ({self.name}) failed: {e}")
+                await self._resign()
+                await self._disconnect()
+            await asyncio.sleep(self.interval)
+
+    def _elect(self) -> None:
+        self.is_leader = True
+        LEADER.set(self.name, value=1)
+        logger.info(f"Became leader ({self.name}), starting {len(self._duties)} duties")
+        self._duty_tasks = [asyncio.create_task(self._run_duty(name, fn), name=f"leader-duty-{name}")
+                            for name, fn in self._duties]
+
+    async def _run_duty(self, name: str, fn: Callable[[], Awaitable[None]]) -> None:
+        try:
+            await fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Leader duty {name} failed: {e}")
+
+    async def _resign(self) -> None:
+        if not self.is_leader:
+            return
+        for task in self._duty_tasks:
+            task.cancel()
+        await asyncio.gather(*self._duty_tasks, return_exceptions=True)
+        self._duty_tasks = []
+        self.is_leader = False
+        LEADER.set(self.name, value=0)
+        logger.info(f"Resigned leadership ({self.name})")
+
+    async def _disconnect(self) -> None:
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        try:
+            await asyncio.wait_for(conn.close(), timeout=self.interval)
+        except Exception:
+            conn.terminate()
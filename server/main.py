@@ -1,46 +1,89 @@
-import uuid
+# Первым: с --startup-profile замеряет импорт всего остального
+import startup
+
+import logging
 from contextlib import asynccontextmanager
 from typing import AsyncIterator, Union
 import asyncpg
 
 from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from aiogram.utils.web_app import safe_parse_webapp_init_data
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 
 from pydantic import BaseModel
-from pathlib import Path
 from datetime import datetime, timezone
 import tempfile
 from typing import Optional
 
-import uvicorn
 import os
+import secrets
 from typing import Optional, List
+from uuid import UUID
 from datetime import datetime, date, time
 import asyncio
 import json
+from time import perf_counter
 
 from pydantic import ValidationError
 
-from bot_notifications import send_event_created_pm, send_event_deleted_pm, send_event_updated_pm, \
-    send_voter_vote_notification_from_result, notify_about_new_votes_from_submit_result, notify_event_finalized, \
-    notify_event_restored, notify_event_updated_participants_from_full
-from models import WebAppUser, EventCreate, EventResponse, EventUpdate, EventUpdateResponse, ErrorResponse, ErrorDetail
+from models import WebAppUser, EventCreate, EventResponse, EventUpdate, EventUpdateResponse, ErrorResponse, ErrorDetail, \
+    ICSRequest
 from db import create_or_update_user, create_event, get_active_user_events, get_archived_user_events, \
     get_event_details_db, delete_event_db, update_event_data, validate_event_update_permissions, submit_votes_db, \
-    finalized_event_db, get_event_by_public_id, restore_event_db, update_event_location_on_finalize
+    finalized_event_db, get_event_by_public_id, restore_event_db, update_event_location_on_finalize, \
+    iter_active_user_events, iter_archived_user_events, check_event_export_permissions, get_event_voters_db, \
+    iter_event_voters, get_event_calendar_version, get_event_calendar_db, get_calendar_token, get_calendar_feed_version, \
+    iter_calendar_feed_events
 
 from db import Database
-from bot import telegram_bot, verify_webapp_init_data, BOT_TOKEN, WEBHOOK_SECRET, WEBHOOK_PATH
-from config import WEBHOOK_URL
+from codec import DefaultResponse, InvalidJSONError, json_response, ndjson_response, read_json, read_model, \
+    wants_ndjson
+from dispatcher import dispatcher
+from outbox import OutboxWorker
+from updates import UpdateQueue
+from leader import LeaderElection
+from ics import FEED_NAME, ICS_KEY_RE, calendar_response, calendar_stream_response, event_calendar, event_calendar_etag, \
+    feed_etag, generate_ics_content, ics_cache, ics_request_key, is_not_modified, load_generated, not_modified_response, \
+    purge_generated, save_generated, stream_calendar
+from config import BOT_TOKEN, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL, ADMIN_TOKEN, BACKGROUND_DRAIN_TIMEOUT, WEBHOOK_DELETE_ON_SHUTDOWN, SERVER_HOST, \
+    SERVER_PORT, WEB_WORKERS
+import metrics
+from middleware import CompressionMiddleware, RequestMetricsMiddleware, add_timing, get_slow_requests, timed
+
+startup.imports_done()
+logging.basicConfig(level=logging.INFO)
+
+
+def load_bot():
+    """Импорт bot.py (а с ним всего aiogram) — в lifespan выполняется в потоке, параллельно с подключением к БД"""
+    with startup.phase("import bot (thread)"):
+        import bot  # noqa: F401
+
+
+def get_telegram_bot():
+    # к первому запросу модуль уже загружен в lifespan, здесь только поиск в sys.modules
+    from bot import telegram_bot
+    return telegram_bot
+
+
+def parse_update(raw: bytes):
+    return get_telegram_bot().parse_update(raw)
+
+
+async def process_update(update):
+    await get_telegram_bot().process_update(update)
+
 
 db = Database()
+outbox_worker = OutboxWorker(db)
+update_queue = UpdateQueue(parse_update, process_update)
 
 
 async def get_db():
     """Генератор соединений для FastAPI Depends"""
+    started = perf_counter()
     async with (await db.get_connection()) as connection:
+        add_timing("pool_wait", perf_counter() - started)
         yield connection
 
 
@@ -49,10 +92,12 @@ async def verify_telegram_webapp(request: Request):
     if not auth_string:
         raise HTTPException(401, detail="Authorization header missing")
 
-    verified_data = verify_webapp_init_data(
-        init_data=auth_string,
-        bot_token=telegram_bot.bot.token
-    )
+    from bot import verify_webapp_init_data
+    with timed("auth"):
+        verified_data = verify_webapp_init_data(
+            init_data=auth_string,
+            bot_token=BOT_TOKEN
+        )
 
     if not verified_data:
         raise HTTPException(401, detail="Invalid Telegram auth data")
@@ -78,21 +123,44 @@ async def get_user_from_telegram_data(parsed_data) -> WebAppUser:
     return user
 
 
-@asynccontextmanager
-async def app_lifespan(_: FastAPI) -> AsyncIterator[None]:
-    await db.connect()
-
+async def register_webhook():
     webhook_url = WEBHOOK_URL
     if webhook_url:
-        await telegram_bot.set_webhook(f"{webhook_url}{WEBHOOK_PATH}")
+        await get_telegram_bot().set_webhook(f"{webhook_url}{WEBHOOK_PATH}")
+
+
+# Разовые обязанности сервиса выполняет один процесс из WEB_WORKERS
+leader = LeaderElection()
+leader.duty("webhook", register_webhook)
+leader.duty("outbox-janitor", outbox_worker.janitor)
+
+
+@asynccontextmanager
+async def app_lifespan(_: FastAPI) -> AsyncIterator[None]:
+    with startup.phase("lifespan"):
+        # aiogram импортируется в потоке, пока процесс подключается к БД, проверяет схему и прогревает пул;
+        # миграции (если схема устарела) сериализованы advisory lock'ом между процессами
+        await asyncio.gather(asyncio.to_thread(load_bot), db.connect())
+        dispatcher.start()
+        await outbox_worker.start()
+        update_queue.start()
+        leader.start()
+    startup.finish()
 
     yield
 
+    await leader.stop()
+    # сначала дорабатываем принятые апдейты: их обработчики могут писать в БД и ставить уведомления
+    await update_queue.stop(BACKGROUND_DRAIN_TIMEOUT)
+    await outbox_worker.stop()
+    await dispatcher.stop()
     await db.close()
-    await telegram_bot.delete_webhook()
+    if WEBHOOK_DELETE_ON_SHUTDOWN:
+        await get_telegram_bot().delete_webhook()
+    await get_telegram_bot().bot.session.close()
 
 
-app = FastAPI(lifespan=app_lifespan)
+app = FastAPI(lifespan=app_lifespan, default_response_class=DefaultResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -102,6 +170,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# gzip/brotli для JSON и .ics; внутри метрик, чтобы время сжатия попадало в латентность запроса
+app.add_middleware(CompressionMiddleware)
+# Снаружи всех остальных middleware, чтобы учитывать полное время запроса
+app.add_middleware(RequestMetricsMiddleware)
 
 
 @app.get("/")
@@ -110,7 +182,28 @@ async def root():
         raise HTTPException(status_code=500, detail="Database not connected")
 
     async with db.pool.acquire() as connection:
-        return JSONResponse(content={"message": "Meety API by Comunna is running"})
+        return ORJSONResponse(content={"message": "Meety API by Comunna is running"})
+
+
+def require_admin(request: Request):
+    """Служебные эндпоинты: X-Admin-Token или Authorization: Bearer (так ходит Prometheus) = ADMIN_TOKEN"""
+    token = request.headers.get("X-Admin-Token")
+    if token is None:
+        scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+        token = credentials if scheme.lower() == "bearer" else None
+    if not ADMIN_TOKEN or not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def slow_requests(limit: Optional[int] = None):
+    """Последние медленные запросы с разбивкой времени (пул, БД, сериализация, авторизация)"""
+    return json_response(get_slow_requests(limit))
 
 
 # Telegram webhook endpoint
@@ -118,38 +211,39 @@ async def root():
 async def webhook(request: Request):
     secret_token = request.headers.get("X-Telegram-Bot-Api-Secret-Token")
     if secret_token != WEBHOOK_SECRET:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=401,
             content={"error": "Invalid secret token"}
         )
 
-    # Process update
-    update_data = await request.json()
+    # Обработка в фоне (updates.UpdateQueue): отвечаем Telegram сразу после постановки в очередь
     try:
-        await telegram_bot.process_update(update_data)
-        return JSONResponse(content={"ok": True})
-    except Exception as ex:
-        print(f'Error processing update: {ex}')
-        raise HTTPException(status_code=500, detail="Internal Server Error")
+        accepted = update_queue.put(await request.body())
+    except (InvalidJSONError, ValidationError) as ex:
+        print(f'Invalid update payload: {ex}')
+        raise HTTPException(status_code=400, detail="Invalid update payload")
+    if not accepted:
+        raise HTTPException(status_code=503, detail="Update queue is full")
+    return ORJSONResponse(content={"ok": True})
 
 
 # Bot management endpoints
 @app.get("/bot/webhook-info")
 async def get_webhook_info():
-    info = await telegram_bot.get_webhook_info()
-    return JSONResponse(content=info)
+    info = await get_telegram_bot().get_webhook_info()
+    return ORJSONResponse(content=info)
 
 
 @app.post("/bot/set-webhook")
 async def set_webhook(webhook_url: str):
-    await telegram_bot.set_webhook(webhook_url)
-    return JSONResponse(content={"message": "Webhook set successfully"})
+    await get_telegram_bot().set_webhook(webhook_url)
+    return ORJSONResponse(content={"message": "Webhook set successfully"})
 
 
 @app.delete("/bot/webhook")
 async def delete_webhook():
-    await telegram_bot.delete_webhook()
-    return JSONResponse(content={"message": "Webhook deleted successfully"})
+    await get_telegram_bot().delete_webhook()
+    return ORJSONResponse(content={"message": "Webhook deleted successfully"})
 
 
 @app.post("/api/validate")
@@ -161,14 +255,11 @@ async def validate_telegram_user(request: Request, conn=Depends(get_db), telegra
 @app.post("/api/events/create")
 async def create_new_event(request: Request, conn: asyncpg.Connection = Depends(get_db),
                            telegram_data=Depends(verify_telegram_webapp)):
-    raw_body = await request.body()
     try:
-        data = json.loads(raw_body)
-        event_data = EventCreate(**data)
+        event_data = await read_model(request, EventCreate)
         event = await create_event(conn, event_data, telegram_data.user.id)
-        asyncio.create_task(send_event_created_pm(telegram_data.user, event))
-        return {"status": "success", "ok": True, "event": event.model_dump()}
-    except json.JSONDecodeError:
+        return json_response({"status": "success", "ok": True, "event": event})
+    except InvalidJSONError:
         raise HTTPException(status_code=422, detail="Invalid JSON format")
     except ValidationError as e:
         raise HTTPException(status_code=422, detail=e.errors())
@@ -178,9 +269,12 @@ async def create_new_event(request: Request, conn: asyncpg.Connection = Depends(
 async def get_active_events(request: Request, conn: asyncpg.Connection = Depends(get_db),
                             telegram_data=Depends(verify_telegram_webapp)):
     user_id = telegram_data.user.id
+    # Соединение из get_db освобождается только после отправки ответа, курсор живёт до конца стрима
+    if wants_ndjson(request):
+        return ndjson_response(iter_active_user_events(conn, user_id))
     try:
         events = await get_active_user_events(conn, user_id)
-        return [dict(event) for event in events]
+        return json_response(events)
     except json.JSONDecodeError:
         raise HTTPException(status_code=422, detail="Invalid JSON format")
     except ValidationError as e:
@@ -191,9 +285,11 @@ async def get_active_events(request: Request, conn: asyncpg.Connection = Depends
 async def get_archived_events(request: Request, conn: asyncpg.Connection = Depends(get_db),
                               telegram_data=Depends(verify_telegram_webapp)):
     user_id = telegram_data.user.id
+    if wants_ndjson(request):
+        return ndjson_response(iter_archived_user_events(conn, user_id))
     try:
         events = await get_archived_user_events(conn, user_id)
-        return [dict(event) for event in events]
+        return json_response(events)
     except json.JSONDecodeError:
         raise HTTPException(status_code=422, detail="Invalid JSON format")
     except ValidationError as e:
@@ -205,7 +301,7 @@ async def get_event_details(event_id: int, conn: asyncpg.Connection = Depends(ge
                             telegram_data=Depends(verify_telegram_webapp)):
     user_id = telegram_data.user.id
     event_details = await get_event_details_db(conn, user_id, event_id)
-    return event_details
+    return json_response(event_details)
 
 
 @app.get("/api/events/public/{event_public_id}")
@@ -213,26 +309,34 @@ async def get_event_details(event_public_id: str, conn: asyncpg.Connection = Dep
                             telegram_data=Depends(verify_telegram_webapp)):
     user_id = telegram_data.user.id
     event_details = await get_event_by_public_id(conn, user_id, event_public_id)
-    return event_details
+    return json_response(event_details)
+
+
+@app.get("/api/events/{event_id}/voters/export")
+async def export_event_voters(event_id: int, request: Request, conn: asyncpg.Connection = Depends(get_db),
+                              telegram_data=Depends(verify_telegram_webapp)):
+    """Выгрузка всех голосов события: JSON-массив или построчный NDJSON-стрим"""
+    await check_event_export_permissions(conn, event_id, telegram_data.user.id)
+    if wants_ndjson(request):
+        return ndjson_response(
+            iter_event_voters(conn, event_id),
+            headers={"Content-Disposition": f"attachment; filename=event_{event_id}_voters.ndjson"}
+        )
+    return json_response(await get_event_voters_db(conn, event_id))
 
 
 @app.delete("/api/events/{event_id}/delete")
 async def delete_event(event_id: int, conn: asyncpg.Connection = Depends(get_db),
                        telegram_data=Depends(verify_telegram_webapp)):
     user_id = telegram_data.user.id
-    result = await delete_event_db(conn, user_id, event_id)
-    if result.get("ok"):
-        asyncio.create_task(send_event_deleted_pm(telegram_data.user, result.get("event"), fallback_event_id=event_id))
-    return result
+    return await delete_event_db(conn, user_id, event_id)
 
 
 @app.put("/api/events/{event_id}", response_model=Union[EventUpdateResponse, ErrorResponse])
 async def update_event(event_id: int, request: Request, conn: asyncpg.Connection = Depends(get_db),
                        telegram_data=Depends(verify_telegram_webapp)):
     try:
-        raw_body = await request.body()
-        data = json.loads(raw_body)
-        event_update = EventUpdate(**data)
+        event_update = await read_model(request, EventUpdate)
 
         if event_update.event.id != event_id:
             raise HTTPException(
@@ -259,21 +363,14 @@ async def update_event(event_id: int, request: Request, conn: asyncpg.Connection
         # 5. Выполняем обновление события
         try:
             updated_event = await update_event_data(conn, event_update, telegram_data.user.id)
-            asyncio.create_task(send_event_updated_pm(telegram_data.user, updated_event.event))
-            asyncio.create_task(
-                notify_event_updated_participants_from_full(
-                    full_event_response=updated_event,
-                    actor_telegram_user_id=telegram_data.user.id,
-                )
-            )
 
             # 6. Возвращаем успешный результат
-            return EventUpdateResponse(
+            return json_response(EventUpdateResponse(
                 status="success",
                 ok=True,
                 message="Event updated successfully",
                 event=updated_event
-            )
+            ))
 
         except ValueError as e:
             raise HTTPException(status_code=422, detail=str(e))
@@ -281,7 +378,7 @@ async def update_event(event_id: int, request: Request, conn: asyncpg.Connection
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
-    except json.JSONDecodeError:
+    except InvalidJSONError:
         raise HTTPException(
             status_code=422,
             detail="Invalid JSON format"
@@ -323,8 +420,8 @@ async def submit_votes(event_id: int, request: Request, conn: asyncpg.Connection
 
     # 1) Безопасно читаем JSON
     try:
-        payload = await request.json()
-    except Exception:
+        payload = await read_json(request)
+    except InvalidJSONError:
         raise HTTPException(status_code=422, detail="Invalid JSON format")
 
     # 2) Достаём и валидируем slot_ids
@@ -351,25 +448,7 @@ async def submit_votes(event_id: int, request: Request, conn: asyncpg.Connection
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    # 4) Уведомления (не блокируем ответ API)
-    #    - Создателю шлём только если были изменения (added/removed)
-    #    - Участнику шлём всегда подтверждение
-    try:
-        from_notifications = False  # просто чтобы подчеркнуть, что ниже — фоновая логика
-        if result.get("slots_added") or result.get("slots_removed"):
-            asyncio.create_task(
-                notify_about_new_votes_from_submit_result(result, voter_user)
-            )
-        else:
-            # нет изменений — отправим только участнику подтверждение
-            asyncio.create_task(
-                send_voter_vote_notification_from_result(result, voter_user)
-            )
-    except Exception as e:
-        # ошибки отправки уведомлений не мешают основному ответу
-        print(f"[submit_votes] notify failed: {e}")
-
-    # 5) Возвращаем результат записи голосов
+    # 4) Уведомления создателю и участнику уже лежат в notification_outbox (та же транзакция)
     return result
 
 
@@ -382,8 +461,8 @@ async def finalized_poll(
 ):
     user_id = telegram_data.user.id
     try:
-        data = await request.json()
-    except Exception:
+        data = await read_json(request)
+    except InvalidJSONError:
         raise HTTPException(status_code=422, detail="Invalid JSON format")
 
     slot_id = data.get("slot_id")
@@ -402,12 +481,6 @@ async def finalized_poll(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    # Фоново шлём уведомления (чтобы не тормозить ответ)
-    try:
-        asyncio.create_task(notify_event_finalized(result))
-    except Exception as e:
-        print(f"[finalized_poll] notify failed: {e}")
-
     return result
 
 
@@ -427,176 +500,132 @@ async def restore_event(
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-    # Фоново шлём уведомления, чтобы не блокировать ответ
-    try:
-        asyncio.create_task(notify_event_restored(result))
-    except Exception as e:
-        print(f"[restore_event] notify failed: {e}")
-
     return result
 
 
-class ICSRequest(BaseModel):
-    title: str
-    description: Optional[str] = ""
-    startDate: str  # ISO string
-    endDate: Optional[str] = None
-    location: Optional[str] = ""
-    timezone: Optional[str] = "UTC"
-
-
-def escape_ics_text(text: str) -> str:
-    """Escape special characters for ICS format"""
-    if not text:
-        return ""
-    return (text.replace("\\", "\\\\")
-            .replace(",", "\\,")
-            .replace(";", "\\;")
-            .replace("\n", "\\n")
-            .replace("\r", ""))
-
-
-def format_ics_date(dt: datetime) -> str:
-    """Format datetime for ICS (YYYYMMDDTHHMMSSZ)"""
-    return dt.strftime("%Y%m%dT%H%M%SZ")
-
-
-def generate_ics_content(request: ICSRequest) -> str:
-    """Generate ICS file content"""
-    try:
-        # Parse start date
-        start_dt = datetime.fromisoformat(request.startDate.replace('Z', '+00:00'))
-        if start_dt.tzinfo is None:
-            start_dt = start_dt.replace(tzinfo=timezone.utc)
-
-        # Parse end date or default to 1 hour later
-        if request.endDate:
-            end_dt = datetime.fromisoformat(request.endDate.replace('Z', '+00:00'))
-            if end_dt.tzinfo is None:
-                end_dt = end_dt.replace(tzinfo=timezone.utc)
-        else:
-            end_dt = start_dt.replace(hour=start_dt.hour + 1)
-
-        # Convert to UTC for ICS
-        start_utc = start_dt.astimezone(timezone.utc)
-        end_utc = end_dt.astimezone(timezone.utc)
-
-        # Generate unique ID
-        event_uid = f"{uuid.uuid4()}@telegram-event.com"
-        timestamp = format_ics_date(datetime.now(timezone.utc))
-
-        # Build ICS content
-        ics_content = f"""BEGIN:VCALENDAR
-VERSION:2.0
-PRODID:-//Telegram Event//Event//EN
-CALSCALE:GREGORIAN
-METHOD:PUBLISH
-BEGIN:VEVENT
-UID:{event_uid}
-DTSTAMP:{timestamp}
-DTSTART:{format_ics_date(start_utc)}
-DTEND:{format_ics_date(end_utc)}
-SUMMARY:{escape_ics_text(request.title)}
-DESCRIPTION:{escape_ics_text(request.description)}
-LOCATION:{escape_ics_text(request.location)}
-STATUS:CONFIRMED
-SEQUENCE:0
-BEGIN:VALARM
-TRIGGER:-PT15M
-ACTION:DISPLAY
-DESCRIPTION:Reminder
-END:VALARM
-END:VEVENT
-END:VCALENDAR"""
-
-        return ics_content.replace('\n', '\r\n')
-
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error parsing dates: {str(e)}")
-
-
 @app.post("/api/generate-ics")
 async def generate_ics(request: ICSRequest):
-    print(1)
     """Generate ICS file and return download URL"""
-    try:
-        # Generate ICS content
-        ics_content = generate_ics_content(request)
+    # Календарь детерминирован по полям запроса: тот же запрос — тот же ключ и тот же файл
+    key = ics_request_key(request)
+    if load_generated(key) is None:
+        save_generated(key, generate_ics_content(request).encode("utf-8"))
 
-        # Create temp directory if it doesn't exist
-        temp_dir = Path("temp/ics")
-        temp_dir.mkdir(parents=True, exist_ok=True)
+    filename = f"event_{key}.ics"
+    return {
+        "success": True,
+        "downloadUrl": f"/download/ics/{filename}",
+        "filename": filename
+    }
 
-        # Generate unique filename
-        filename = f"event_{uuid.uuid4().hex[:8]}.ics"
-        filepath = temp_dir / filename
 
-        # Write ICS file
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(ics_content)
+@app.get("/download/ics/{filename}")
+async def download_ics(filename: str, request: Request):
+    """Download ICS file"""
+    key = filename.removeprefix("event_").removesuffix(".ics")
+    if not filename.startswith("event_") or not filename.endswith(".ics") or not ICS_KEY_RE.fullmatch(key):
+        raise HTTPException(status_code=400, detail="Invalid filename")
 
-        # Return download URL
-        download_url = f"/download/ics/{filename}"
+    cached = load_generated(key)
+    if cached is None:
+        raise HTTPException(status_code=404, detail="File not found")
 
-        return {
-            "success": True,
-            "downloadUrl": download_url,
-            "filename": filename
-        }
+    content, etag = cached
+    # содержимое по ключу не меняется — браузер может держать его до истечения записи в кеше
+    return calendar_response(request, content, etag, filename=filename,
+                             cache_control=f"private, max-age={int(ics_cache.ttl)}")
+
+
+@app.get("/api/events/{public_id}/calendar.ics")
+async def event_calendar_ics(public_id: UUID, request: Request, conn: asyncpg.Connection = Depends(get_db)):
+    """
+    Календарь события для подписки по ссылке. Без авторизации WebApp: календарные
+    приложения её не передают, доступ даёт знание public_id (как и у ссылки на событие).
+    """
+    version = await get_event_calendar_version(conn, public_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+
+    # ETag по updated_at: опрос без изменений отвечает 304 без чтения слотов и генерации
+    etag = event_calendar_etag(public_id, version)
+    if is_not_modified(request, etag, version):
+        return not_modified_response(etag, version)
+
+    key = f"event:{public_id}:{etag}"
+    cached = ics_cache.get(key)
+    if cached is None:
+        rows = await get_event_calendar_db(conn, public_id)
+        if not rows:
+            raise HTTPException(status_code=404, detail="Event not found")
+        # версию берём из тех же строк: событие могли изменить между двумя запросами
+        version = rows[0]["version"]
+        etag = event_calendar_etag(public_id, version)
+        key = f"event:{public_id}:{etag}"
+        content = event_calendar(rows).encode("utf-8")
+        ics_cache.put(key, content, etag)
+    else:
+        content = cached[0]
+    return calendar_response(request, content, etag, filename=f"event_{public_id}.ics", last_modified=version)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating ICS file: {str(e)}")
 
+def calendar_feed_urls(request: Request, token: str) -> dict:
+    base = WEBHOOK_URL or str(request.base_url).rstrip("/")
+    url = f"{base}/calendar/{token}.ics"
+    return {"url": url, "webcalUrl": "webcal://" + url.split("://", 1)[-1]}
 
-@app.get("/download/ics/{filename}")
-async def download_ics(filename: str):
-    """Download ICS file"""
-    # Validate filename to prevent path traversal
-    if not filename.endswith('.ics') or '/' in filename or '\\' in filename:
-        raise HTTPException(status_code=400, detail="Invalid filename")
 
-    filepath = Path("temp/ics") / filename
+@app.get("/api/calendar/subscription")
+async def calendar_subscription(request: Request, conn: asyncpg.Connection = Depends(get_db),
+                                telegram_data=Depends(verify_telegram_webapp)):
+    """Ссылка на ленту завершённых событий пользователя для подписки в календаре"""
+    token = await get_calendar_token(conn, telegram_data.user.id)
+    return calendar_feed_urls(request, token)
 
-    if not filepath.exists():
-        raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(
-        path=filepath,
-        media_type='text/calendar',
-        filename=filename,
-        headers={
-            "Content-Disposition": f"attachment; filename={filename}",
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "Pragma": "no-cache",
-            "Expires": "0"
-        }
-    )
+@app.post("/api/calendar/subscription/reset")
+async def reset_calendar_subscription(request: Request, conn: asyncpg.Connection = Depends(get_db),
+                                      telegram_data=Depends(verify_telegram_webapp)):
+    """Новый токен ленты: старая ссылка перестаёт работать"""
+    token = await get_calendar_token(conn, telegram_data.user.id, reset=True)
+    return calendar_feed_urls(request, token)
 
 
-# Optional: Cleanup old files endpoint
-@app.delete("/api/cleanup-ics")
-async def cleanup_old_ics_files():
-    """Clean up ICS files older than 1 hour"""
-    try:
-        temp_dir = Path("temp/ics")
-        if not temp_dir.exists():
-            return {"cleaned": 0}
+@app.get("/calendar/{token}.ics")
+async def calendar_feed(token: str, request: Request, conn: asyncpg.Connection = Depends(get_db)):
+    """
+    Лента завершённых событий пользователя (создал или голосовал). Календари опрашивают её
+    каждые несколько минут: без изменений это один запрос отпечатка и 304 или ответ из кеша.
+    """
+    version = await get_calendar_feed_version(conn, token)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Calendar not found")
 
-        current_time = datetime.now().timestamp()
-        cleaned_count = 0
+    etag = feed_etag(version["fingerprint"])
+    last_modified = version["last_modified"]
+    if is_not_modified(request, etag, last_modified):
+        return not_modified_response(etag, last_modified)
 
-        for file_path in temp_dir.glob("*.ics"):
-            # Check if file is older than 1 hour
-            if current_time - file_path.stat().st_mtime > 3600:
-                file_path.unlink()
-                cleaned_count += 1
+    # одна запись на пользователя: новая версия ленты заменяет прежнюю
+    key = f"feed:{version['user_id']}"
+    cached = ics_cache.get(key, etag)
+    if cached is not None:
+        return calendar_response(request, cached[0], etag, last_modified=last_modified)
+    # Соединение из get_db освобождается только после отправки ответа, курсор живёт до конца стрима
+    rows = iter_calendar_feed_events(conn, version["user_id"])
+    return calendar_stream_response(stream_calendar(rows, key, etag, FEED_NAME), etag, last_modified)
 
-        return {"cleaned": cleaned_count}
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error during cleanup: {str(e)}")
+# Optional: Cleanup old files endpoint
+@app.delete("/api/cleanup-ics")
+async def cleanup_old_ics_files():
+    """Drop expired ICS files from the cache and ICS_DIR"""
+    return {"cleaned": purge_generated()}
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=80)
+    import uvicorn
+    # при workers > 1 приложение передаётся строкой импорта: каждый процесс импортирует main сам
+    # (для одного процесса — объектом, иначе main импортировался бы второй раз);
+    # loop="auto" берёт uvloop, если он установлен (на Windows его нет)
+    uvicorn.run(app if WEB_WORKERS == 1 else "main:app", host=SERVER_HOST, port=SERVER_PORT, workers=WEB_WORKERS, loop="auto", http="httptools")
 
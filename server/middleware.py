@@ -0,0 +1,248 @@
+"""
+ASGI middleware: латентность по шаблонам маршрутов и разбор медленных запросов,
+сжатие ответов.
+
+На время запроса в contextvar кладётся RequestTiming; get_db, db.py, codec,
+проверка подписи Telegram и сжатие добавляют в него своё время через add_timing().
+"""
+import asyncio
+import gzip
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterator, List, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from config import (COMPRESS_BROTLI_QUALITY, COMPRESS_GZIP_LEVEL, COMPRESS_MIN_SIZE, COMPRESS_THREAD_MIN_SIZE,
+                    SLOW_REQUEST_BUFFER_SIZE, SLOW_REQUEST_MS)
+from metrics import Counter, Gauge, Histogram
+
+try:
+    import brotli
+except ImportError:  # без пакета Brotli отдаём только gzip
+    brotli = None
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route")
+)
+HTTP_RESPONSES = Counter("http_responses_total", "Responses by route template and status", ("method", "route", "status"))
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being processed", ("method",))
+HTTP_COMPRESSED = Counter("http_compressed_responses_total", "Compressed responses by encoding", ("encoding",))
+HTTP_COMPRESSION_BYTES = Counter(
+    "http_compression_bytes_total", "Response bytes before and after compression", ("encoding", "stage")
+)
+
+TIMING_COMPONENTS = ("pool_wait", "db", "serialization", "auth", "compression")
+
+
+class RequestTiming:
+    __slots__ = ("pool_wait", "db", "serialization", "auth", "compression", "db_queries")
+
+    def __init__(self):
+        self.pool_wait = 0.0
+        self.db = 0.0
+        self.serialization = 0.0
+        self.auth = 0.0
+        self.compression = 0.0
+        self.db_queries = 0
+
+
+_current_timing: ContextVar[Optional[RequestTiming]] = ContextVar("request_timing", default=None)
+
+# Последние медленные запросы (кольцевой буфер, старые вытесняются)
+SLOW_REQUESTS: Deque[Dict] = deque(maxlen=SLOW_REQUEST_BUFFER_SIZE)
+
+
+def add_timing(component: str, seconds: float) -> None:
+    timing = _current_timing.get()
+    if timing is None:
+        return
+    setattr(timing, component, getattr(timing, component) + seconds)
+    if component == "db":
+        timing.db_queries += 1
+
+
+@contextmanager
+def timed(component: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(component, time.perf_counter() - started)
+
+
+def get_slow_requests(limit: Optional[int] = None) -> List[Dict]:
+    items = list(SLOW_REQUESTS)
+    items.reverse()  # свежие сверху
+    return items[:limit] if limit else items
+
+
+def _route_template(scope) -> str:
+    # FastAPI кладёт найденный маршрут в scope["route"]; без него не плодим метки по сырым путям
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app, slow_request_ms: float = SLOW_REQUEST_MS):
+        self.app = app
+        self.slow_request_seconds = slow_request_ms / 1000
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        timing = RequestTiming()
+        token = _current_timing.set(timing)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _current_timing.reset(token)
+            HTTP_IN_FLIGHT.dec(method)
+
+            route = _route_template(scope)
+            HTTP_REQUEST_SECONDS.observe(elapsed, method, route)
+            HTTP_RESPONSES.inc(method, route, str(status_code))
+            if elapsed >= self.slow_request_seconds:
+                self._record_slow(scope, method, route, status_code, elapsed, timing)
+
+    @staticmethod
+    def _record_slow(scope, method: str, route: str, status_code: int, elapsed: float, timing: RequestTiming):
+        breakdown = {f"{c}_ms": round(getattr(timing, c) * 1000, 2) for c in TIMING_COMPONENTS}
+        SLOW_REQUESTS.append({
+            "at": datetime.now(timezone.utc).isoformat(),
+            "method": method,
+            "route": route,
+            "path": scope.get("path"),
+            "status": status_code,
+            "total_ms": round(elapsed * 1000, 2),
+            **breakdown,
+            "db_queries": timing.db_queries,
+            "other_ms": round(elapsed * 1000 - sum(breakdown.values()), 2),
+        })
+
+
+# Что сжимаем (по media type ответа)
+COMPRESSIBLE_TYPES = ("application/json", "text/calendar")
+# Потолок уровней: выше — в разы дороже по CPU при выигрыше в размере на единицы процентов
+MAX_GZIP_LEVEL = 6
+MAX_BROTLI_QUALITY = 6
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """br, если клиент его принимает и пакет установлен, иначе gzip; q=0 — кодировка запрещена"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip()] = q
+    for encoding in (("br", "gzip") if brotli is not None else ("gzip",)):
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int, brotli_quality: int) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime=0: одинаковое тело даёт одинаковые байты
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    Сжимает gzip/brotli ответы JSON и .ics от min_size байт. Стриминговые ответы (NDJSON,
+    лента календаря) не трогаем: тело не буферизуется. Большие тела сжимаются в потоке.
+    ETag сжатого ответа становится слабым (как у nginx): If-None-Match сравнивается слабо.
+    """
+
+    def __init__(self, app, min_size: int = COMPRESS_MIN_SIZE, gzip_level: int = COMPRESS_GZIP_LEVEL,
+                 brotli_quality: int = COMPRESS_BROTLI_QUALITY, thread_min_size: int = COMPRESS_THREAD_MIN_SIZE):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = max(1, min(gzip_level, MAX_GZIP_LEVEL))
+        self.brotli_quality = max(0, min(brotli_quality, MAX_BROTLI_QUALITY))
+        self.thread_min_size = thread_min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                # заголовки отправим вместе с первым куском тела, когда станет ясно, сжимаем ли
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            headers = MutableHeaders(scope=start)
+            body = message.get("body", b"")
+            media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+            compressible = media_type in COMPRESSIBLE_TYPES
+            if compressible:
+                headers.add_vary_header("Accept-Encoding")
+            if (not compressible or encoding is None or message.get("more_body", False)
+                    or len(body) < self.min_size or "content-encoding" in headers
+                    or start["status"] in (204, 304)):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            started = time.perf_counter()
+            if len(body) >= self.thread_min_size:
+                compressed = await asyncio.to_thread(compress, body, encoding, self.gzip_level, self.brotli_quality)
+            else:
+                compressed = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            add_timing("compression", time.perf_counter() - started)
+            if len(compressed) >= len(body):
+                passthrough = True
+                await send(start)
+                await send(message)
+                return
+
+            HTTP_COMPRESSED.inc(encoding)
+            HTTP_COMPRESSION_BYTES.inc(encoding, "in", amount=len(body))
+            HTTP_COMPRESSION_BYTES.inc(encoding, "out", amount=len(compressed))
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            etag = headers.get("etag")
+            if etag and not etag.startswith("W/"):
+                headers["ETag"] = "W/" + etag
+            await send(start)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
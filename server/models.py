@@ -144,6 +144,17 @@ class SlotVoterResponse(UserResponse):
     voted_at: datetime
 
 
+class VoterExportResponse(BaseModel):
+    """Строка выгрузки голосов: один голос участника за один слот"""
+    slot_id: int
+    slot_start: datetime
+    telegram_user_id: int
+    username: Optional[str] = None
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    voted_at: datetime
+
+
 class EventSlotResponse(BaseModel):
     id: int
     slot_start: datetime
@@ -275,4 +286,13 @@ class ErrorResponse(BaseModel):
     status: str = "error"
     ok: bool = False
     message: str
-    errors: Optional[List[ErrorDetail]] = None
\ No newline at end of file
+    errors: Optional[List[ErrorDetail]] = None
+
+
+class ICSRequest(BaseModel):
+    title: str
+    description: Optional[str] = ""
+    startDate: str  # ISO string
+    endDate: Optional[str] = None
+    location: Optional[str] = ""
+    timezone: Optional[str] = "UTC"
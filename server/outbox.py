@@ -0,0 +1,274 @@
+"""
+Воркер очереди уведомлений notification_outbox.
+
+Строки пишут функции db.py в той же транзакции, что и само изменение, поэтому
+рестарт или падение процесса уведомления не теряют. Воркер:
+- забирает пачку готовых строк (FOR UPDATE SKIP LOCKED + аренда locked_until),
+  так что несколько воркеров/процессов разбирают очередь параллельно без дублей;
+- рендерит сообщение (bot_notifications) и отправляет через диспетчер с лимитами;
+- успешные помечает sent_at, ошибки откладывает с экспоненциальной паузой,
+  после OUTBOX_MAX_ATTEMPTS (или на постоянной ошибке Telegram) — failed_at (dead letter);
+- если бот заблокирован или чата нет, помечает пользователя (users.undeliverable_at):
+  его ждущие строки сразу уходят в dead letter, а новые рассылки его пропускают.
+Просыпается по LISTEN/NOTIFY сразу после коммита, иначе раз в OUTBOX_POLL_INTERVAL.
+"""
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+import asyncpg
+
+from config import (DB_URL, NOTIFY_DRAIN_TIMEOUT, OUTBOX_BATCH_SIZE, OUTBOX_LEASE_SECONDS, OUTBOX_MAX_ATTEMPTS,
+                    OUTBOX_POLL_INTERVAL, OUTBOX_RETENTION_HOURS, OUTBOX_WORKERS)
+from db import OUTBOX_CHANNEL
+from dispatcher import PRIORITY_BULK, PRIORITY_DIRECT, dispatcher
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Ответы на действие пользователя идут в приоритетной полосе диспетчера
+DIRECT_KINDS = frozenset({
+    "event_created", "event_deleted", "event_updated", "vote_voter",
+    "event_finalized_creator", "event_restored_creator",
+})
+MAX_BACKOFF_SECONDS = 600
+# Фрагменты описания ошибки Telegram, после которых писать в чат бесполезно до следующего входа пользователя
+UNDELIVERABLE_REASONS = (
+    ("bot was blocked by the user", "bot_blocked"),
+    ("user is deactivated", "user_deactivated"),
+    ("chat not found", "chat_not_found"),
+    ("bot can't initiate conversation", "not_started"),
+)
+
+OUTBOX_PROCESSED = Counter("outbox_processed_total", "Outbox rows processed by outcome", ("kind", "outcome"))
+OUTBOX_PENDING = Gauge("outbox_pending", "Outbox rows waiting to be sent")
+
+CLAIM_QUERY = """
+    UPDATE notification_outbox o
+    SET locked_until = NOW() + make_interval(secs => $2), attempts = o.attempts + 1
+    WHERE o.id IN (
+        SELECT id FROM notification_outbox
+        WHERE sent_at IS NULL AND failed_at IS NULL
+          AND available_at <= NOW()
+          AND (locked_until IS NULL OR locked_until < NOW())
+        ORDER BY id
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.id, o.kind, o.chat_id, o.language_code, o.payload, o.attempts
+"""
+
+
+async def claim_batch(conn: asyncpg.Connection, limit: int, lease_seconds: float) -> List[asyncpg.Record]:
+    return await conn.fetch(CLAIM_QUERY, limit, lease_seconds)
+
+
+async def mark_sent(conn: asyncpg.Connection, ids: List[int]):
+    await conn.execute(
+        "UPDATE notification_outbox SET sent_at = NOW(), locked_until = NULL, last_error = NULL WHERE id = ANY($1)",
+        ids
+    )
+
+
+async def mark_failed(conn: asyncpg.Connection, row_id: int, error: str, retry_in: Optional[float]):
+    """retry_in=None — больше не пытаемся (dead letter)"""
+    if retry_in is None:
+        await conn.execute(
+            "UPDATE notification_outbox SET failed_at = NOW(), locked_until = NULL, last_error = $2 WHERE id = $1",
+            row_id, error
+        )
+    else:
+        await conn.execute(
+            """
+            UPDATE notification_outbox
+            SET available_at = NOW() + make_interval(secs => $3), locked_until = NULL, last_error = $2
+            WHERE id = $1
+            """,
+            row_id, error, retry_in
+        )
+
+
+def is_permanent_error(error: BaseException) -> bool:
+    """Повторять бессмысленно: бот заблокирован, чата нет, сообщение некорректно"""
+    # aiogram не импортируем на уровне модуля (см. bot.py); к первой ошибке отправки он уже загружен
+    from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+    return isinstance(error, (TelegramForbiddenError, TelegramBadRequest))
+
+
+def undeliverable_reason(error: BaseException) -> Optional[str]:
+    if not is_permanent_error(error):
+        return None
+    message = str(error).lower()
+    for fragment, reason in UNDELIVERABLE_REASONS:
+        if fragment in message:
+            return reason
+    return None
+
+
+async def mark_undeliverable(conn: asyncpg.Connection, chat_id: int, reason: str) -> Tuple[str, str]:
+    """Помечает пользователя и закрывает его остальные ждущие строки (кроме уже взятых воркерами)"""
+    async with conn.transaction():
+        user_status = await conn.execute(
+            "UPDATE users SET undeliverable_at = NOW(), undeliverable_reason = $2 WHERE telegram_user_id = $1",
+            chat_id, reason
+        )
+        outbox_status = await conn.execute(
+            """
+            UPDATE notification_outbox SET failed_at = NOW(), last_error = $2
+            WHERE chat_id = $1 AND sent_at IS NULL AND failed_at IS NULL
+              AND (locked_until IS NULL OR locked_until < NOW())
+            """,
+            chat_id, f"undeliverable: {reason}"
+        )
+    return user_status, outbox_status
+
+
+async def flush_digests(conn: asyncpg.Connection) -> str:
+    # сводки, ещё ждущие окна, отправляем сразу (остановка процесса)
+    return await conn.execute(
+        """
+        UPDATE notification_outbox SET available_at = NOW()
+        WHERE kind = 'vote_digest' AND sent_at IS NULL AND failed_at IS NULL AND available_at > NOW()
+        """
+    )
+
+
+async def purge_sent(conn: asyncpg.Connection, retention_hours: float) -> str:
+    # dead letter (failed_at) не трогаем — их разбирают руками
+    return await conn.execute(
+        "DELETE FROM notification_outbox WHERE sent_at < NOW() - make_interval(hours => $1)",
+        retention_hours
+    )
+
+
+class OutboxWorker:
+    def __init__(self, database, workers: int = OUTBOX_WORKERS, batch_size: int = OUTBOX_BATCH_SIZE,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 lease_seconds: float = OUTBOX_LEASE_SECONDS):
+        self.database = database
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._listener: Optional[asyncpg.Connection] = None
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        try:
+            self._listener = await asyncpg.connect(DB_URL)
+            await self._listener.add_listener(OUTBOX_CHANNEL, self._on_notify)
+        except Exception as e:
+            # без LISTEN работаем опросом
+            logger.warning(f"Outbox LISTEN unavailable, polling only: {e}")
+            self._listener = None
+        self._tasks = [asyncio.create_task(self._run(), name=f"outbox-worker-{i}") for i in range(self.workers)]
+
+    async def stop(self, timeout: float = NOTIFY_DRAIN_TIMEOUT):
+        """
+        Выпускает отложенные сводки голосов и даёт воркерам разобрать всё готовое
+        (не дольше timeout), затем останавливает.
+        Недоставленные строки остаются в БД до следующего запуска (или до истечения аренды).
+        """
+        try:
+            async with self.database.pool.acquire() as conn:
+                await flush_digests(conn)
+        except Exception as e:
+            logger.error(f"Failed to flush vote digests: {e}")
+        self._stopping = True
+        self._wakeup.set()
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+
+    def _on_notify(self, *_):
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox batch failed: {e}")
+                processed = 0
+            if self._stopping:
+                # при остановке дочищаем готовые строки и выходим, когда очередь опустела
+                if processed == 0:
+                    return
+                continue
+            if processed < self.batch_size:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def run_once(self) -> int:
+        """Забирает и отправляет одну пачку; возвращает число обработанных строк"""
+        async with self.database.pool.acquire() as conn:
+            rows = await claim_batch(conn, self.batch_size, self.lease_seconds)
+        if not rows:
+            return 0
+
+        results = await asyncio.gather(*(self._deliver(row) for row in rows), return_exceptions=True)
+
+        sent_ids = []
+        async with self.database.pool.acquire() as conn:
+            for row, result in zip(rows, results):
+                if result is None:
+                    sent_ids.append(row["id"])
+                    OUTBOX_PROCESSED.inc(row["kind"], "sent")
+                    continue
+                await self._record_failure(conn, row, result)
+            if sent_ids:
+                await mark_sent(conn, sent_ids)
+        return len(rows)
+
+    async def _deliver(self, row: asyncpg.Record) -> None:
+        from bot_notifications import render_outbox_row
+        message = render_outbox_row(row["kind"], row["language_code"], row["payload"])
+        priority = PRIORITY_DIRECT if row["kind"] in DIRECT_KINDS else PRIORITY_BULK
+        await dispatcher.send_message(chat_id=row["chat_id"], priority=priority, **message)
+
+    async def _record_failure(self, conn: asyncpg.Connection, row: asyncpg.Record, error: BaseException):
+        text = f"{type(error).__name__}: {error}"[:1000]
+        reason = undeliverable_reason(error)
+        if reason is not None:
+            OUTBOX_PROCESSED.inc(row["kind"], "undeliverable")
+            logger.info(f"Chat {row['chat_id']} is undeliverable ({reason}), skipping it in fan-outs")
+            await mark_failed(conn, row["id"], text, None)
+            await mark_undeliverable(conn, row["chat_id"], reason)
+        elif is_permanent_error(error) or row["attempts"] >= self.max_attempts:
+            OUTBOX_PROCESSED.inc(row["kind"], "dead")
+            logger.warning(f"Outbox row {row['id']} ({row['kind']}) dead-lettered: {text}")
+            await mark_failed(conn, row["id"], text, None)
+        else:
+            OUTBOX_PROCESSED.inc(row["kind"], "retry")
+            await mark_failed(conn, row["id"], text, min(MAX_BACKOFF_SECONDS, 2 ** row["attempts"]))
+
+    async def janitor(self):
+        """Чистка отправленных строк и gauge очереди; одна на сервис — запускается лидером (leader.py)"""
+        while True:
+            await asyncio.sleep(60)
+            try:
+                async with self.database.pool.acquire() as conn:
+                    await purge_sent(conn, OUTBOX_RETENTION_HOURS)
+                    OUTBOX_PENDING.set(value=await conn.fetchval(
+                        "SELECT count(*) FROM notification_outbox WHERE sent_at IS NULL AND failed_at IS NULL"
+                    ))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Outbox cleanup failed: {e}")
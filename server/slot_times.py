@@ -0,0 +1,89 @@
+"""
+Пакетные преобразования времени слотов.
+
+Сетка слотов события — это набор дат и строк "HH:MM" в таймзоне события.
+Вместо ZoneInfo/replace/astimezone на каждый слот считаем UTC-смещение
+один раз на (таймзона, дата) и переводим весь день сложением timedelta.
+Дни с переходом на летнее/зимнее время обрабатываются медленным путём по слотам.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+MINUTES_PER_DAY = 24 * 60
+
+# Предрассчитанные строки "HH:MM" для всех минут суток
+_HHMM = tuple(f"{m // 60:02d}:{m % 60:02d}" for m in range(MINUTES_PER_DAY))
+_MINUTE_DELTAS = tuple(timedelta(minutes=m) for m in range(MINUTES_PER_DAY))
+_LAST_MINUTE = time(23, 59)
+
+
+@lru_cache(maxsize=None)
+def get_zone(tz_name: str) -> ZoneInfo:
+    return ZoneInfo(tz_name)
+
+
+@lru_cache(maxsize=MINUTES_PER_DAY)
+def parse_hhmm(value: str) -> int:
+    """'HH:MM' -> минуты от начала суток"""
+    hours, minutes = value.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+@lru_cache(maxsize=4096)
+def _day_offset(tz_name: str, day: date) -> Optional[timedelta]:
+    """
+    UTC-смещение таймзоны на весь день или None, если в этот день смещение меняется
+    (переход на летнее/зимнее время).
+    """
+    zone = get_zone(tz_name)
+    start = datetime.combine(day, time.min, tzinfo=zone).utcoffset()
+    end = datetime.combine(day, _LAST_MINUTE, tzinfo=zone).utcoffset()
+    return start if start == end else None
+
+
+def local_day_to_utc(tz_name: str, day: date, minutes: Iterable[int]) -> List[datetime]:
+    offset = _day_offset(tz_name, day)
+    if offset is not None:
+        # UTC-полночь этой даты минус смещение зоны — дальше только сложение
+        base = datetime.combine(day, time.min, tzinfo=timezone.utc) - offset
+        return [base + _MINUTE_DELTAS[m] for m in minutes]
+
+    zone = get_zone(tz_name)
+    return [
+        datetime.combine(day, time(m // 60, m % 60), tzinfo=zone).astimezone(timezone.utc)
+        for m in minutes
+    ]
+
+
+def local_grid_to_utc(tz_name: str, grid: Iterable[Tuple[date, Iterable[str]]]) -> List[datetime]:
+    """Переводит сетку [(дата, ["HH:MM", ...]), ...] из таймзоны события в UTC"""
+    result: List[datetime] = []
+    for day, time_slots in grid:
+        result.extend(local_day_to_utc(tz_name, day, [parse_hhmm(t) for t in time_slots]))
+    return result
+
+
+def to_utc(value: datetime) -> datetime:
+    """
+    Наивные значения считаем локальным временем сервера, как asyncpg при записи
+    в timestamptz (он вызывает astimezone()): нормализация не меняет записанный момент
+    """
+    return value.astimezone(timezone.utc)
+
+
+def format_hhmm(value: datetime) -> str:
+    return _HHMM[value.hour * 60 + value.minute]
+
+
+def group_slots_by_date(rows: Iterable) -> Dict[date, List[dict]]:
+    """Группирует строки слотов (id, slot_start) по дате в виде {"id", "time": "HH:MM"}"""
+    grouped: Dict[date, List[dict]] = {}
+    for row in rows:
+        slot_start = row["slot_start"]
+        grouped.setdefault(slot_start.date(), []).append({
+            "id": row["id"],
+            "time": _HHMM[slot_start.hour * 60 + slot_start.minute],
+        })
+    return grouped
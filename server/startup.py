@@ -0,0 +1,104 @@
+"""
+Замер холодного старта процесса.
+
+Фазы старта (импорт, пул БД, миграции, прогрев, загрузка aiogram) всегда пишутся в метрику
+startup_phase_seconds, а общее время сверяется с бюджетом STARTUP_BUDGET_SECONDS.
+С ключом --startup-profile (python main.py --startup-profile) или STARTUP_PROFILE=1 дополнительно
+замеряется импорт модулей, и после старта печатается отчёт:
+    import time by module (inclusive, >= 5 ms)  — дерево импортов по вложенности;
+    startup phases                              — смещение от начала и длительность каждой фазы
+    (фазы, идущие параллельно, перекрываются по смещению).
+Модуль импортируется в main первым, до fastapi и остальных зависимостей.
+"""
+import builtins
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from config import STARTUP_BUDGET_SECONDS
+from metrics import Gauge
+
+logger = logging.getLogger(__name__)
+
+STARTUP_PHASES = Gauge("startup_phase_seconds", "Duration of process startup phases", ("phase",))
+STARTUP_TOTAL = Gauge("startup_seconds", "Time from the first import to serving requests")
+
+STARTED = time.perf_counter()
+ENABLED = "--startup-profile" in sys.argv or os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+if ENABLED:
+    # процессы uvicorn --workers импортируют main заново и не видят ключ командной строки
+    os.environ["STARTUP_PROFILE"] = "1"
+
+# В отчёт попадают импорты до этой вложенности и не короче порога
+IMPORT_DEPTH = 3
+IMPORT_MIN_SECONDS = 0.005
+
+_phases: List[Tuple[str, float, float]] = []
+_imports: List[Tuple[float, int, str, float]] = []
+_local = threading.local()
+_original_import = builtins.__import__
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    depth = getattr(_local, "depth", 0)
+    if level or name in sys.modules or depth >= IMPORT_DEPTH:
+        return _original_import(name, globals, locals, fromlist, level)
+    _local.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _local.depth = depth
+        _imports.append((started, depth, name, time.perf_counter() - started))
+
+
+if ENABLED:
+    builtins.__import__ = _timed_import
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, started)
+
+
+def imports_done() -> None:
+    """Отмечает конец импорта main"""
+    _record("import main", STARTED)
+
+
+def _record(name: str, started: float) -> None:
+    seconds = time.perf_counter() - started
+    _phases.append((name, started - STARTED, seconds))
+    STARTUP_PHASES.set(name, value=seconds)
+
+
+def finish() -> float:
+    """Старт завершён: метрика, предупреждение о превышении бюджета и (с профилем) отчёт"""
+    total = time.perf_counter() - STARTED
+    STARTUP_TOTAL.set(value=total)
+    if total > STARTUP_BUDGET_SECONDS:
+        logger.warning(f"Startup took {total:.2f}s, budget is {STARTUP_BUDGET_SECONDS:.2f}s")
+    if ENABLED:
+        builtins.__import__ = _original_import
+        print(report(total), file=sys.stderr, flush=True)
+    return total
+
+
+def report(total: float) -> str:
+    lines = [f"startup profile (pid {os.getpid()}): {total * 1000:.0f} ms to serving", "",
+             "import time by module (inclusive, >= 5 ms)"]
+    for started, depth, name, seconds in sorted(_imports):
+        if seconds >= IMPORT_MIN_SECONDS:
+            lines.append(f"  {seconds * 1000:>8.1f} ms  {'  ' * depth}{name}")
+    lines += ["", "startup phases", f"  {'start':>8}  {'duration':>9}"]
+    for name, offset, seconds in sorted(_phases, key=lambda p: p[1]):
+        lines.append(f"  {offset * 1000:>6.0f} ms  {seconds * 1000:>6.1f} ms  {name}")
+    return "\n".join(lines)
@@ -0,0 +1,124 @@
+"""
+Фоновые задания процесса с ограниченной параллельностью.
+
+Вместо голого asyncio.create_task (ссылку на задачу никто не держит, сборщик мусора
+может её потерять, всплеск запросов порождает неограниченное число корутин,
+а остановка обрывает начатое) задания ставятся в TaskSupervisor:
+- очередь хранит функцию и аргументы, корутина создаётся только когда есть свободный слот;
+- задания выполняют `concurrency` воркеров, на них супервизор держит ссылки;
+- очередь ограничена: submit() сообщает о переполнении, put() ждёт места (backpressure);
+- drain() перестаёт принимать задания и дожидается очереди не дольше дедлайна.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+TASKS_QUEUED = Gauge("background_tasks_queued", "Jobs waiting for a free worker", ("supervisor",))
+TASKS_RUNNING = Gauge("background_tasks_running", "Jobs being executed", ("supervisor",))
+TASKS_TOTAL = Counter("background_tasks_total", "Finished jobs by outcome", ("supervisor", "outcome"))
+
+Job = Tuple[Callable[..., Awaitable[Any]], tuple, dict]
+
+
+class TaskSupervisor:
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running = 0
+        self._closed = False
+
+    # --- публичный API ---
+
+    def start(self) -> None:
+        if self._workers and not all(w.done() for w in self._workers):
+            return
+        self._closed = False
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._workers = [asyncio.create_task(self._work(), name=f"{self.name}-{i}") for i in range(self.concurrency)]
+
+    def submit(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> bool:
+        """Ставит fn(*args, **kwargs) в очередь; False — супервизор остановлен или очередь полна (задание сброшено)"""
+        if self._closed:
+            TASKS_TOTAL.inc(self.name, "rejected")
+            return False
+        self.start()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except asyncio.QueueFull:
+            TASKS_TOTAL.inc(self.name, "rejected")
+            logger.warning(f"{self.name}: queue is full ({self.queue_size}), job {fn.__qualname__} dropped")
+            return False
+        self._update_depth()
+        return True
+
+    async def put(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> None:
+        """Как submit, но при полной очереди ждёт места"""
+        if self._closed:
+            raise RuntimeError(f"{self.name} supervisor is stopped")
+        self.start()
+        await self._queue.put((fn, args, kwargs))
+        self._update_depth()
+
+    def busy(self) -> int:
+        """Заданий в очереди и в работе"""
+        return (self._queue.qsize() if self._queue is not None else 0) + self._running
+
+    async def drain(self, timeout: float) -> List[Job]:
+        """
+        Перестаёт принимать задания, ждёт очередь не дольше timeout, выполняющиеся отменяет.
+        Возвращает задания, которые так и не начались.
+        """
+        self._closed = True
+        if not self._workers:
+            return []
+        deadline = time.monotonic() + timeout
+        while self.busy() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        dropped: List[Job] = []
+        while not self._queue.empty():
+            dropped.append(self._queue.get_nowait())
+            self._queue.task_done()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if dropped:
+            TASKS_TOTAL.inc(self.name, "dropped", amount=len(dropped))
+            logger.warning(f"{self.name}: stopped with {len(dropped)} queued jobs not started")
+        self._queue = None
+        self._running = 0
+        self._update_depth()
+        return dropped
+
+    # --- воркеры ---
+
+    def _update_depth(self) -> None:
+        TASKS_QUEUED.set(self.name, value=self._queue.qsize() if self._queue is not None else 0)
+        TASKS_RUNNING.set(self.name, value=self._running)
+
+    async def _work(self) -> None:
+        while True:
+            fn, args, kwargs = await self._queue.get()
+            self._running += 1
+            self._update_depth()
+            try:
+                await fn(*args, **kwargs)
+                TASKS_TOTAL.inc(self.name, "ok")
+            except asyncio.CancelledError:
+                TASKS_TOTAL.inc(self.name, "cancelled")
+                raise
+            except Exception as e:
+                TASKS_TOTAL.inc(self.name, "error")
+                logger.error(f"{self.name}: job {fn.__qualname__} failed: {e}")
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+                self._update_depth()
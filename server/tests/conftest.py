@@ -0,0 +1,20 @@
+"""
+Тесты сервера: python -m pytest server/tests
+
+Модули сервера импортируются как в main.py, по плоским именам (config, db, ics), поэтому
+каталог server добавляется в sys.path. Тесты с БД выполняются, только если задан
+TEST_DB_URL (отдельная база: каждый тест создаёт и удаляет свою схему).
+"""
+import os
+import sys
+import tempfile
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+# config читает их при импорте; main без них не поднимает бота
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("WEBHOOK_PATH", "/webhook")
+# календари /api/generate-ics пишутся на диск — не в temp/ics рабочего каталога
+os.environ.setdefault("ICS_DIR", tempfile.mkdtemp(prefix="ics-"))
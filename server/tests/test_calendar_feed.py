@@ -0,0 +1,88 @@
+import asyncio
+import os
+import uuid
+
+import asyncpg
+import pytest
+
+import db
+from ics import format_http_date, not_modified_since
+
+TEST_DB_URL = os.getenv("TEST_DB_URL")
+
+pytestmark = pytest.mark.skipif(not TEST_DB_URL, reason="TEST_DB_URL is not set")
+
+
+async def _scratch_db() -> asyncpg.Connection:
+    """Соединение со свежей схемой: create_tables в ней, search_path на неё"""
+    conn = await asyncpg.connect(TEST_DB_URL)
+    schema = f"test_{uuid.uuid4().hex[:12]}"
+    await conn.execute(f"CREATE SCHEMA {schema}")
+    await conn.execute(f"SET search_path TO {schema}")
+    await db.create_tables(conn)
+    return conn
+
+
+async def _drop_scratch_db(conn: asyncpg.Connection) -> None:
+    schema = await conn.fetchval("SELECT current_schema()")
+    await conn.execute(f"DROP SCHEMA {schema} CASCADE")
+    await conn.close()
+
+
+async def _finalized_event(conn: asyncpg.Connection, creator_id: int, age: str) -> int:
+    """Событие, завершённое age назад (created_at = updated_at = NOW() - age)"""
+    event_id = await conn.fetchval(
+        """
+        INSERT INTO events (public_id, user_id, title, created_at, updated_at)
+        VALUES ($1, $2, 'Event', NOW() - $3::interval, NOW() - $3::interval)
+        RETURNING id
+        """,
+        uuid.uuid4(), creator_id, age
+    )
+    slot_id = await conn.fetchval(
+        "INSERT INTO event_slots (event_id, slot_start) VALUES ($1, NOW() + interval '1 day') RETURNING id",
+        event_id
+    )
+    await conn.execute("UPDATE events SET final_slot_id = $2 WHERE id = $1", event_id, slot_id)
+    return event_id
+
+
+async def _vote(conn: asyncpg.Connection, event_id: int, user_id: int, age: str = "0") -> None:
+    await conn.execute(
+        """
+        INSERT INTO event_votes (event_id, slot_id, user_id, created_at)
+        SELECT id, final_slot_id, $2, NOW() - $3::interval FROM events WHERE id = $1
+        """,
+        event_id, user_id, age
+    )
+
+
+def test_vote_on_old_finalized_event_moves_last_modified():
+    """
+    Голос за давно завершённое событие добавляет его в ленту: клиент, который
+    перепроверяет ленту только по If-Modified-Since, не должен получить 304.
+    """
+    async def run():
+        conn = await _scratch_db()
+        try:
+            creator_id = await conn.fetchval("INSERT INTO users (telegram_user_id) VALUES (1) RETURNING id")
+            voter_id = await conn.fetchval("INSERT INTO users (telegram_user_id) VALUES (2) RETURNING id")
+            # в ленте уже есть событие трёхдневной давности; второе завершено пять дней назад
+            in_feed = await _finalized_event(conn, creator_id, "3 days")
+            await _vote(conn, in_feed, voter_id, "3 days")
+            joined_later = await _finalized_event(conn, creator_id, "5 days")
+
+            token = await db.get_calendar_token(conn, 2)
+            before = await db.get_calendar_feed_version(conn, token)
+            if_modified_since = format_http_date(before["last_modified"])
+
+            await _vote(conn, joined_later, voter_id)
+            after = await db.get_calendar_feed_version(conn, token)
+        finally:
+            await _drop_scratch_db(conn)
+
+        assert after["fingerprint"] != before["fingerprint"]
+        assert after["last_modified"] > before["last_modified"]
+        assert not not_modified_since(if_modified_since, after["last_modified"])
+
+    asyncio.run(run())
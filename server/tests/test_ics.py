@@ -0,0 +1,15 @@
+from fastapi.testclient import TestClient
+
+import main
+
+ICS_REQUEST = {"title": "Planning", "startDate": "2026-10-20T10:00:00Z"}
+
+
+def test_download_content_type_has_single_charset():
+    client = TestClient(main.app)
+    url = client.post("/api/generate-ics", json=ICS_REQUEST).json()["downloadUrl"]
+
+    response = client.get(url)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "text/calendar; charset=utf-8"
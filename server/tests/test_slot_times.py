@@ -0,0 +1,35 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from slot_times import to_utc
+
+
+@pytest.fixture
+def server_tz(monkeypatch):
+    """Локальная таймзона процесса на время теста"""
+    def set_tz(name: str) -> None:
+        monkeypatch.setenv("TZ", name)
+        time.tzset()
+
+    yield set_tz
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_to_utc_reads_naive_values_as_server_local_time(server_tz):
+    # как asyncpg для timestamptz: наивное время — локальное время сервера (здесь UTC+5)
+    server_tz("Asia/Yekaterinburg")
+    naive = datetime(2026, 10, 20, 10, 0)
+
+    assert to_utc(naive) == datetime(2026, 10, 20, 5, 0, tzinfo=timezone.utc)
+    assert to_utc(naive) == naive.astimezone(timezone.utc)
+
+
+def test_to_utc_keeps_the_instant_of_aware_values(server_tz):
+    server_tz("America/New_York")
+    aware = datetime(2026, 10, 20, 10, 0, tzinfo=timezone(timedelta(hours=3)))
+
+    assert to_utc(aware) == datetime(2026, 10, 20, 7, 0, tzinfo=timezone.utc)
+    assert to_utc(aware).tzinfo is timezone.utc
@@ -0,0 +1,135 @@
+"""
+Очередь входящих апдейтов Telegram для webhook.
+
+Webhook только проверяет секрет, кладёт апдейт в очередь и сразу отвечает 200:
+медленный обработчик больше не задерживает доставку и не вызывает повторов от Telegram.
+- Апдейты раскладываются по шардам по chat id: у каждого шарда свой воркер, поэтому
+  разные чаты обрабатываются параллельно, а сообщения одного чата — строго по порядку.
+- Повторная доставка (тот же update_id в пределах окна WEBHOOK_DEDUPE_WINDOW) отбрасывается.
+- Очередь шарда ограничена; при переполнении webhook отвечает 503 и Telegram повторит позже.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Deque, List, Optional, Set
+
+from config import WEBHOOK_DEDUPE_WINDOW, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+from metrics import Counter, Gauge, Histogram
+
+if TYPE_CHECKING:
+    # aiogram грузится лениво (см. bot.py)
+    from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_UPDATES = Counter("webhook_updates_total", "Telegram updates by outcome", ("outcome",))
+WEBHOOK_QUEUE_DEPTH = Gauge("webhook_queue_depth", "Updates waiting to be processed")
+WEBHOOK_UPDATE_LAG = Histogram("webhook_update_seconds", "Time from webhook ack to processed update")
+
+
+def update_chat_id(update: "Update") -> Optional[int]:
+    """id чата апдейта: message.chat, callback_query.message.chat, inline_query.from_user и т.п."""
+    from aiogram.types.update import UpdateTypeLookupError
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        return None
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return user.id if user is not None else None
+
+
+class UpdateQueue:
+    def __init__(self, parse: Callable[[bytes], "Update"], process: Callable[["Update"], Awaitable[Any]], workers: int = WEBHOOK_WORKERS,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE, dedupe_window: int = WEBHOOK_DEDUPE_WINDOW):
+        self.parse = parse
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self._shards: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+        self._processing = 0
+        self._seen: Set[int] = set()
+        self._seen_order: Deque[int] = deque()
+        self.dedupe_window = dedupe_window
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        per_shard = max(1, self.queue_size // self.workers)
+        self._shards = [asyncio.Queue(maxsize=per_shard) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._work(shard), name=f"webhook-worker-{i}")
+                       for i, shard in enumerate(self._shards)]
+
+    async def stop(self, timeout: float) -> None:
+        """Обрабатывает принятые апдейты не дольше timeout; необработанные Telegram уже не повторит"""
+        if not self._tasks:
+            return
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        dropped = self.pending()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._shards = []
+        WEBHOOK_QUEUE_DEPTH.set(value=0)
+        if dropped:
+            WEBHOOK_UPDATES.inc("dropped", amount=dropped)
+            logger.warning(f"Webhook queue stopped with {dropped} unprocessed updates")
+
+    def pending(self) -> int:
+        return sum(shard.qsize() for shard in self._shards) + self._processing
+
+    def put(self, raw: bytes) -> bool:
+        """
+        Принимает тело webhook. True — апдейт принят (или это повтор, который уже принят),
+        False — очередь шарда полна, Telegram должен повторить доставку.
+        Некорректное тело — исключение parse (InvalidJSONError / ValidationError).
+        """
+        update = self.parse(raw)
+        update_id = update.update_id
+        if update_id in self._seen:
+            WEBHOOK_UPDATES.inc("duplicate")
+            return True
+        self.start()
+        chat_id = update_chat_id(update)
+        shard = self._shards[hash(chat_id if chat_id is not None else update_id) % self.workers]
+        try:
+            shard.put_nowait((update, time.perf_counter()))
+        except asyncio.QueueFull:
+            WEBHOOK_UPDATES.inc("rejected")
+            return False
+        self._remember(update_id)
+        WEBHOOK_UPDATES.inc("queued")
+        WEBHOOK_QUEUE_DEPTH.inc()
+        return True
+
+    def _remember(self, update_id: Optional[int]) -> None:
+        if update_id is None:
+            return
+        self._seen.add(update_id)
+        self._seen_order.append(update_id)
+        if len(self._seen_order) > self.dedupe_window:
+            self._seen.discard(self._seen_order.popleft())
+
+    async def _work(self, shard: asyncio.Queue) -> None:
+        while True:
+            update, queued_at = await shard.get()
+            WEBHOOK_QUEUE_DEPTH.dec()
+            self._processing += 1
+            try:
+                await self.process(update)
+                WEBHOOK_UPDATES.inc("processed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                WEBHOOK_UPDATES.inc("error")
+                logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                WEBHOOK_UPDATE_LAG.observe(time.perf_counter() - queued_at)
+                self._processing -= 1